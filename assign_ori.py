@@ -9,8 +9,13 @@
 # @Last Modified At: 2021-04-05 21:50:18
 # @Description: Assign orientation read from MTEX to RVE cell.
 
+import heapq
 import json
-import secrets
+import os
+
+import numpy as np
+
+from compile_bank import CompiledMatBank
 
 class AssignOriToRve():
     """
@@ -19,17 +24,33 @@ class AssignOriToRve():
         the RVE.
     """
 
-    def __init__(self, ori_json_path, hierarch_dict):
+    # maximal number of match degrees calculated at once
+    match_block_size = 1 << 24
+
+    def __init__(self, ori_json_path, hierarch_dict, assignment="greedy", seed=None):
         """ initialize the properties """
 
         # pass arguments to parameters
         self.ori_json_path = ori_json_path
         self.hierarch_dict = hierarch_dict
-        # initialize a empty dictionary
-        self.mat_ori_dict = None
-        self.assigned_ori_dict = {}
-        # auto run
-        self.__load_ori_json()
+        # "greedy" selects best remaining PAG in sequence of priority,
+        # "optimal" maximizes total match degree over all RVE PAGs
+        if assignment not in ("greedy", "optimal"):
+            raise ValueError("Unknown assignment mode '{}'".format(assignment))
+        self.assignment = assignment
+        # seed of random orientation extension, a fresh one is recorded if not given
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.rng = np.random.default_rng(self.seed)
+        # compiled material bank, memory-mapped
+        self.mat_bank = None
+        # assigned euler angles (phi1, phi, phi2), row i is grain i+1
+        self.assigned_ori = np.zeros((0, 3))
+        # match list and hierarchical dict of matched PAGs in material bank
+        self.match_relationship = []
+        self.mat_hierarch_dict = {}
+        # auto run, nothing is assigned if material bank cannot be loaded
+        if not self.__load_ori_json():
+            return
         # match list
         (self.match_relationship, self.mat_hierarch_dict) \
              = self.__matching_hierarch_find()
@@ -40,10 +61,18 @@ class AssignOriToRve():
         """ load .json file where material orientation was stored in """
 
         try:
-            with open(self.ori_json_path) as mat_ori_json:
-                self.mat_ori_dict = json.loads(mat_ori_json.read())
-        except FileExistsError or FileNotFoundError:
-            print("\n\nError! No Material Orientation Json File was Found! Please Check Input Path Again!\n")
+            self.mat_bank = CompiledMatBank(self.ori_json_path)
+        except FileNotFoundError as error:
+            if not os.path.exists(self.ori_json_path):
+                print("\n\nError! No Material Orientation Json File was Found! Please Check Input Path Again!\n")
+            else:
+                print("\n\nError! Material Bank cannot be Loaded: {}\n".format(repr(error)))
+            return False
+        except (OSError, ValueError, KeyError) as error:
+            print("\n\nError! Material Bank cannot be Loaded: {}\n".format(repr(error)))
+            return False
+
+        return True
 
     def __matching_hierarch_find(self):
         """ find best matching relationship between PAG in RVE and the one in material bank """
@@ -52,54 +81,188 @@ class AssignOriToRve():
         available_pag_list = self.__mat_json_layer_match()
         # export hierarchical info of each PAG in available list
         mat_hierarch_dict = self.__mat_pag_hierarch_export(available_pag_list)
-        # match dict
-        match_dict = {}
-        # loop over each PAG in RVE and find which PAG in material bank is best matched
-        for rve_pag, pck_list in self.hierarch_dict.items():
-            sorted_pck_list = sorted(pck_list, reverse=True)
-            crt_match_list = self.__match_list(sorted_pck_list, mat_hierarch_dict)
-            # create a key, value couple for current rve PAG
-            # where key is RVE PAG name and value is matching list
-            match_dict[str(rve_pag)] = {"match_list": crt_match_list, "priority": sum(sorted_pck_list)}
-        # sorted match dict by priority 
-        priority_sorted_pag_name_ls = sorted(match_dict, key=lambda pag_name:(match_dict[pag_name]["priority"]), reverse=True)
-        # select best match PAG in material bank in sequence of priority
+        # sorted package lists of PAGs in RVE
+        rve_pag_names = [str(rve_pag) for rve_pag in self.hierarch_dict.keys()]
+        rve_pck_lists = [sorted(pck_list, reverse=True) for pck_list in self.hierarch_dict.values()]
+        if len(available_pag_list) == 0 or len(rve_pck_lists) == 0:
+            print("\nError! No PAG in Material Bank is Available for RVE!\n")
+            return ([], mat_hierarch_dict)
+        # index of RVE PAGs keyed by package size signature, PAGs with
+        # same signature share one row of match degree and ranked candidates
+        rve_signature_index = {}
+        for rve_ind in range(len(rve_pck_lists)):
+            rve_signature_index.setdefault(tuple(rve_pck_lists[rve_ind]), []).append(rve_ind)
+        rve_signatures = list(rve_signature_index.keys())
+        rve_rows = np.zeros(len(rve_pck_lists), dtype=np.int64)
+        for (row, signature) in enumerate(rve_signatures):
+            rve_rows[rve_signature_index[signature]] = row
+        mat_pag_names = [info_tuple[0] for info_tuple in available_pag_list]
+        signature_lists = [list(signature) for signature in rve_signatures]
+        # RVE PAGs sorted by priority, equal priorities keep order of RVE
+        priorities = [sum(pck_list) for pck_list in rve_pck_lists]
+        priority_order = sorted(range(len(rve_pck_lists)), key=lambda rve_ind:(priorities[rve_ind]), reverse=True)
+        # cumulative package sizes of each available PAG in material bank
+        mat_cum_sizes = self.__mat_cum_sizes(mat_pag_names)
+        # matched column in material bank for each RVE PAG, -1 if no candidate is left,
+        # and its best ranked column which is reused in that case
+        if self.assignment == "optimal":
+            (matched_cols, best_cols) = self.__optimal_match(rve_pck_lists, mat_cum_sizes)
+        else:
+            # greedy selection may go down to the last RVE PAG
+            (ranked_degrees, ranked_cands) = self.__match_matrix(signature_lists, mat_pag_names, \
+                cand_num=len(rve_pck_lists))
+            cand_positions = self.__greedy_match(rve_rows, priority_order, ranked_cands)
+            matched_cols = np.where(cand_positions >= 0, \
+                ranked_cands[rve_rows, np.maximum(cand_positions, 0)], -1)
+            best_cols = ranked_cands[rve_rows, 0]
+        # select matched PAG in material bank in sequence of priority
         # and stored by tuple list
         final_match_list = []
-        for ind in range(len(priority_sorted_pag_name_ls)):
-            crt_pag_name = str(priority_sorted_pag_name_ls[ind])
-            # select candidate tuple from match list 
-            for candidate_tuple in match_dict[crt_pag_name]["match_list"]:
-                # if tuple is already selected by PAG with higher priority
-                if self.__selected_state_judge(final_match_list, candidate_tuple):
-                    continue
-                else:
-                    crt_match_tpl = (crt_pag_name, candidate_tuple)
-                    break
+        for rve_ind in priority_order:
+            crt_pag_name = rve_pag_names[rve_ind]
+            crt_col = int(matched_cols[rve_ind])
+            # no candidate is left, reuse the best matched one
+            if crt_col < 0:
+                crt_col = int(best_cols[rve_ind])
+                print("\nWarning! Not Enough PAGs in Material Bank, PAG {} is Reused for {}!\n".format(\
+                    mat_pag_names[crt_col], crt_pag_name))
+            crt_degree = mat_cum_sizes[crt_col, len(rve_pck_lists[rve_ind]) - 1] - priorities[rve_ind]
+            crt_match_tpl = (crt_pag_name, (mat_pag_names[crt_col], int(crt_degree)))
             # append to final match list
             final_match_list.append(crt_match_tpl)
         
         # return final matched list
         return (final_match_list, mat_hierarch_dict)
 
-    def __selected_state_judge(self, match_list, current_candidate_tuple):
-        """ tell whether current candidate tuple is already in match list """
+    def __greedy_match(self, rve_rows, priority_order, ranked_cands):
+        """
+            given signature row of each RVE PAG, RVE PAGs sorted by priority and ranked
+            candidates of each row, select best candidate not taken by PAG with higher
+            priority, return position of selected candidate for each RVE PAG, -1 if all
+            candidates are taken.
+        """
 
-        # extract tuple from match list
-        try:
-            slctd_pag_list = [match_tuple[1][0] for match_tuple in match_list]
-            if current_candidate_tuple[0] in slctd_pag_list:
-                return True
-            else:
-                return False
-        except KeyError:
-            pass
+        cand_positions = np.full(len(rve_rows), -1, dtype=np.int64)
+        # material PAGs already selected by PAG with higher priority
+        taken_set = set()
+        # memo of ranked candidates and position of first candidate not taken for each signature,
+        # since taken PAGs only accumulate, candidates before this position stay taken
+        ranked_memo = {}
+        cursors = {}
+        for rve_ind in priority_order:
+            crt_row = int(rve_rows[rve_ind])
+            if crt_row not in ranked_memo:
+                ranked_memo[crt_row] = ranked_cands[crt_row].tolist()
+                cursors[crt_row] = 0
+            crt_ranked = ranked_memo[crt_row]
+            # skip candidates already taken
+            while cursors[crt_row] < len(crt_ranked) and crt_ranked[cursors[crt_row]] in taken_set:
+                cursors[crt_row] = cursors[crt_row] + 1
+            if cursors[crt_row] < len(crt_ranked):
+                cand_positions[rve_ind] = cursors[crt_row]
+                taken_set.add(crt_ranked[cursors[crt_row]])
+
+        return cand_positions
+
+    def __optimal_match(self, rve_pck_lists, mat_cum_sizes):
+        """
+            given sorted package lists of RVE PAGs and cumulative package sizes of available
+            PAGs in material bank, return matched column for each RVE PAG which maximizes total
+            match degree, -1 if no column is left, and its best ranked column. RVE PAGs with same
+            package number k value material PAGs alike, by their size of first k packages, so
+            each group of them is one node of a transportation problem against material PAGs,
+            which is solved by taking one PAG at a time along the longest augmenting path.
+        """
+
+        (mat_num, rve_num) = (mat_cum_sizes.shape[0], len(rve_pck_lists))
+        rve_pck_nums = np.array([len(pck_list) for pck_list in rve_pck_lists], dtype=np.int64)
+        (group_pck_nums, rve_groups, group_sizes) = np.unique(rve_pck_nums, return_inverse=True, \
+            return_counts=True)
+        group_num = len(group_pck_nums)
+        # value of each material PAG for each group, match degree without constant of RVE PAG,
+        # relative to the best PAG of the group which is reused if material PAGs are not enough
+        values = mat_cum_sizes[:, group_pck_nums - 1].T
+        values = values - values.max(axis=1)[:, None]
+        # ranking of material PAGs for each group, equal values keep order of material PAGs
+        group_rankings = [np.argsort(-values[group], kind="stable") for group in range(group_num)]
+        best_cols = np.array([ranking[0] for ranking in group_rankings], dtype=np.int64)[rve_groups]
+        value_lists = values.tolist()
+        # group holding each material PAG, group_num for free ones
+        holders = [group_num] * mat_num
+        # free PAGs are only ever taken, so they are scanned in ranking of each group by a cursor,
+        # PAGs held by a group are kept in heaps keyed by loss of moving them to each other group
+        free_cursors = [0] * group_num
+        held_heaps = [[[] for target in range(group_num)] for holder in range(group_num)]
+        demands = group_sizes.tolist()
+        for unit in range(min(rve_num, mat_num)):
+            # best gain and PAG of moving one PAG from each holder to each group, free PAGs last
+            moves = np.full((group_num + 1, group_num), -np.inf)
+            move_cols = np.full((group_num + 1, group_num), -1, dtype=np.int64)
+            for target in range(group_num):
+                ranking = group_rankings[target]
+                while holders[ranking[free_cursors[target]]] != group_num:
+                    free_cursors[target] = free_cursors[target] + 1
+                move_cols[group_num, target] = ranking[free_cursors[target]]
+                moves[group_num, target] = value_lists[target][move_cols[group_num, target]]
+                for holder in range(group_num):
+                    heap = held_heaps[holder][target]
+                    # drop PAGs which have been moved away
+                    while len(heap) != 0 and holders[heap[0][1]] != holder:
+                        heapq.heappop(heap)
+                    if len(heap) != 0:
+                        moves[holder, target] = -heap[0][0]
+                        move_cols[holder, target] = heap[0][1]
+            # longest paths from free PAGs to each group, no cycle between groups has positive
+            # gain since each PAG is taken along a longest path
+            gains = np.full(group_num + 1, -np.inf)
+            gains[group_num] = 0.
+            preds = np.full(group_num, group_num, dtype=np.int64)
+            for step in range(group_num):
+                path_gains = gains[:, None] + moves
+                path_preds = path_gains.argmax(axis=0)
+                path_gains = path_gains[path_preds, np.arange(group_num)]
+                longer = path_gains > gains[:group_num]
+                if not longer.any():
+                    break
+                gains[:group_num][longer] = path_gains[longer]
+                preds[longer] = path_preds[longer]
+            # group with demand left and longest path takes one more PAG, each group
+            # on the path passes one PAG to the next
+            target = int(np.argmax(np.where(np.array(demands) > 0, gains[:group_num], -np.inf)))
+            demands[target] = demands[target] - 1
+            while target != group_num:
+                holder = int(preds[target])
+                crt_col = int(move_cols[holder, target])
+                holders[crt_col] = target
+                for next_target in range(group_num):
+                    if next_target != target:
+                        heapq.heappush(held_heaps[target][next_target], \
+                            (value_lists[target][crt_col] - value_lists[next_target][crt_col], crt_col))
+                target = holder
+        # PAGs of each group are handed out to its RVE PAGs in ranking order
+        holders = np.array(holders, dtype=np.int64)
+        matched_cols = np.full(rve_num, -1, dtype=np.int64)
+        for group in range(group_num):
+            group_cols = group_rankings[group][holders[group_rankings[group]] == group]
+            group_rows = np.flatnonzero(rve_groups == group)
+            matched_cols[group_rows[:len(group_cols)]] = group_cols
+
+        return (matched_cols, best_cols)
+
+    def __mat_cum_sizes(self, mat_pag_names):
+        """ given names of available PAGs in material bank, return their cumulative package sizes """
+
+        mat_pag_inds = [self.mat_bank.pag_index[pag_name] for pag_name in mat_pag_names]
+
+        return np.cumsum(self.mat_bank.pag_signatures[mat_pag_inds], axis=1)
 
     def __assign_ori(self):
         """ given final match relationship, assign orientation to RVE grains """
 
         # modify the RVE hierarchical dictionary for further operation
         mdf_rve_hierarch_dict = self.__rve_hierarch_modify(self.hierarch_dict)
+        if len(self.match_relationship) != 0:
+            self.assigned_ori = np.full((sum(sum(pck_list) for pck_list in self.hierarch_dict.values()), 3), np.nan)
         # loop over relationship list to assign orientation
         for relation_tuple in self.match_relationship:
             rve_pag = relation_tuple[0]
@@ -113,43 +276,29 @@ class AssignOriToRve():
                 crt_pck_beg_ind = crt_pck_tpl[2]
                 # current package tuple in material bank
                 crt_mat_pck_tpl = self.mat_hierarch_dict[str(mat_pag)][index]
-                crt_mat_pck_name = crt_mat_pck_tpl[0]
+                crt_mat_pck_ind = crt_mat_pck_tpl[2]
 
-                # 
+                # rows of orientations in material bank, extended by random rows
                 # if grain number in current RVE package is large than it in corresponding package material
-                if crt_pck_tpl[1] > crt_mat_pck_tpl[1]:
-                    # extending grain number in current package from material bank
-                    mat_ori_list = \
-                        self.__extend_mat_pck_dict(mat_pag, crt_mat_pck_name, goal_grain_num=\
-                            crt_pck_tpl[1])
-                # otherwise
-                else:
-                    mat_ori_list = self.mat_ori_dict[mat_pag][crt_mat_pck_name]
-                # assign orientation to grain in current package
-                for lc_gr_ind in range(crt_pck_grs_num):
-                    # global grain index
-                    grain_key =  str(lc_gr_ind + crt_pck_beg_ind)
-                    # to assigned orientation
-                    ori = mat_ori_list[lc_gr_ind]
-                    # append to final dictionary
-                    self.assigned_ori_dict[grain_key] = ori
-
-
-    def __extend_mat_pck_dict(self, material_pag_name, material_pck_name, goal_grain_num):
-        """ 
-            given material PAG name as well as one of its material package name,
-            return a extended orientation list where elements are extended 
-            orientation of grains.
+                # assign orientation to grains in current package, global grain index begins with 1
+                self.assigned_ori[crt_pck_beg_ind-1:crt_pck_beg_ind-1+crt_pck_grs_num] = \
+                    self.mat_bank.ori[self.__mat_pck_ori_rows(crt_mat_pck_ind, crt_pck_grs_num)]
+
+
+    def __mat_pck_ori_rows(self, material_pck_ind, goal_grain_num):
+        """
+            given material package index, return row indices of goal_grain_num orientations
+            in material bank. If the package has less grains, extra rows are drawn at random
+            from its grains in one call, so that the bank itself stays unchanged.
         """
 
-        # extract original orientation list
-        original_ori_list = self.mat_ori_dict[material_pag_name][material_pck_name]
-        # random select orientation and append it to original orientation list
-        while len(original_ori_list) < goal_grain_num:
-            random_selected_ori = secrets.choice(original_ori_list)
-            original_ori_list.append(random_selected_ori)
+        pck_beg = int(self.mat_bank.pck_offsets[material_pck_ind])
+        pck_end = int(self.mat_bank.pck_offsets[material_pck_ind+1])
+        if goal_grain_num <= pck_end - pck_beg:
+            return np.arange(pck_beg, pck_beg + goal_grain_num)
+        extra_rows = self.rng.integers(pck_beg, pck_end, size=goal_grain_num - (pck_end - pck_beg))
 
-        return original_ori_list
+        return np.concatenate((np.arange(pck_beg, pck_end), extra_rows))
 
     def __rve_hierarch_modify(self, rve_hierarchical_dictionary):
         """ 
@@ -193,37 +342,49 @@ class AssignOriToRve():
         #return modified dictionary
         return modified_dict
 
-    def __match_list(self, rve_pck_list, mat_hierarch_dict):
+    def __match_matrix(self, rve_pck_lists, mat_pag_names, cand_num=None):
         """ 
-            get package list of a RVE PAG and loop over material hierarchical dictionary,
-            return a sorted match list where the first element is the best matched PAG in
-            material bank whereas the last one is the worse matched PAG.
+            given sorted package lists of RVE PAGs and names of available PAGs in material bank,
+            return ranked candidate columns for each RVE PAG where the first one is the best
+            matched PAG in material bank, as well as their match degrees. Only the best cand_num
+            candidates are ranked, by default len(rve_pck_lists), since no more can be taken
+            by other RVE PAGs. Match degrees are calculated in blocks of rows, so that the
+            full matrix is never built.
         """
 
-        # a local container for storing match results
-        match_list = []
-        for pag_name, hierarch_list in mat_hierarch_dict.items():
-            # calculate match degree between current PAG and given RVE PAG
-            match_degree = self.__match_degree_calc(rve_pck_list, hierarch_list)
-            calc_result_tpl = (str(pag_name), match_degree)
-            match_list.append(calc_result_tpl)
-        
-        #sorted by match degree
-        match_list = sorted(match_list, key=lambda tuple:(tuple[1]), reverse=True)
-        return match_list
-
-    def __match_degree_calc(self, rve_pck_list, mat_pck_list):
-        """ calculate the match degree between given PAG and given RVE PAG """
-
-        match_degree = 0
-        # loop over all elements in RVE package list
-        for i in range(len(rve_pck_list)):
-            crt_rve_pck_grains_num = rve_pck_list[i]
-            crt_mat_pck_grains_num = mat_pck_list[i][1]
-            crt_degree = crt_mat_pck_grains_num - crt_rve_pck_grains_num
-            match_degree = match_degree + crt_degree
-        
-        return match_degree
+        if cand_num is None:
+            cand_num = len(rve_pck_lists)
+        mat_num = len(mat_pag_names)
+        cand_num = min(mat_num, cand_num)
+        ranked_degrees = np.zeros((len(rve_pck_lists), cand_num), dtype=np.int64)
+        ranked_cands = np.zeros((len(rve_pck_lists), cand_num), dtype=np.int64)
+        if cand_num == 0 or len(rve_pck_lists) == 0:
+            return (ranked_degrees, ranked_cands)
+        # index of material PAGs keyed by package count and size signature,
+        # PAGs with same signature share one column while calculating
+        mat_pag_inds = [self.mat_bank.pag_index[pag_name] for pag_name in mat_pag_names]
+        (mat_signatures, mat_signature_inv) = np.unique(self.mat_bank.pag_signatures[mat_pag_inds], \
+            axis=0, return_inverse=True)
+        mat_signature_inv = mat_signature_inv.ravel()
+        # match degree is the summed grain number difference over the first k packages,
+        # where k is the package number of RVE PAG, so cumulative package sizes suffice
+        mat_cum_sizes = np.cumsum(mat_signatures, axis=1)
+        rve_pck_nums = np.array([len(pck_list) for pck_list in rve_pck_lists], dtype=np.int64)
+        rve_pck_sums = np.array([sum(pck_list) for pck_list in rve_pck_lists], dtype=np.int64)
+        block_rows = max(1, self.match_block_size // mat_num)
+        for beg in range(0, len(rve_pck_lists), block_rows):
+            end = min(len(rve_pck_lists), beg + block_rows)
+            match_degree = (mat_cum_sizes[:, rve_pck_nums[beg:end] - 1].T - \
+                rve_pck_sums[beg:end, None])[:, mat_signature_inv]
+            # rank by match degree in descending order, equal degrees keep order of material PAGs
+            rank_key = -match_degree * mat_num + np.arange(mat_num)
+            block_cands = np.argpartition(rank_key, cand_num - 1, axis=1)[:, :cand_num]
+            block_cands = np.take_along_axis(block_cands, \
+                np.argsort(np.take_along_axis(rank_key, block_cands, axis=1), axis=1), axis=1)
+            ranked_cands[beg:end] = block_cands
+            ranked_degrees[beg:end] = np.take_along_axis(match_degree, block_cands, axis=1)
+
+        return (ranked_degrees, ranked_cands)
 
     def __mat_pag_hierarch_export(self, available_pag_list):
         """ return a hierarchical dictionary of available PAG """
@@ -232,17 +393,13 @@ class AssignOriToRve():
         for info_tuple in available_pag_list:
             # current pag name
             crt_pag_name = info_tuple[0]
-            # container to store hierarchical information
-            pck_list =[]
-            # loop all packages
-            for pck_name, ori_list in self.mat_ori_dict[crt_pag_name].items():
-                # tuple for package name and its length
-                pck_tuple = (str(pck_name), int(len(ori_list)))
-                pck_list.append(pck_tuple)
-            # sort list
-            pck_list = sorted(pck_list, key=lambda tuple:(tuple[1]), reverse=True)
+            # packages of current PAG, sorted by grain number in compiled bank
+            pck_inds = self.mat_bank.pag_packages(self.mat_bank.pag_index[crt_pag_name]).tolist()
+            # tuple for package name, its length and its index in bank
+            pck_list = [(self.mat_bank.pck_names[pck_ind], int(self.mat_bank.pck_sizes[pck_ind]), pck_ind) \
+                for pck_ind in pck_inds]
             # add key,value couple to mat hierarchical dictionary
-            mat_hierarch_pag_dict[crt_pag_name] = list(pck_list)
+            mat_hierarch_pag_dict[crt_pag_name] = pck_list
 
         return mat_hierarch_pag_dict
 
@@ -254,17 +411,11 @@ class AssignOriToRve():
         if max_pck_number == 0:
             print("\nError! No Package Numbers has been Read! Please Check .Stcell File Again.\n")
         else:
-            for pag, pck_dict in self.mat_ori_dict.items():
-                if len(pck_dict.keys()) < max_pck_number:
-                    continue
-                else:
-                    # how many grains are included in PAG
-                    grain_num = 0
-                    for pck_name, grains_list in pck_dict.items():
-                        grain_num = grain_num + len(grains_list)
-                    # append info to tuple
-                    info_tuple = (str(pag), len(pck_dict.keys()), grain_num)
-                    ava_list.append(info_tuple)
+            # PAGs with enough packages, package and grain numbers from compiled bank
+            for pag_ind in np.flatnonzero(self.mat_bank.pag_pck_num >= max_pck_number).tolist():
+                info_tuple = (self.mat_bank.pag_names[pag_ind], int(self.mat_bank.pag_pck_num[pag_ind]), \
+                    int(self.mat_bank.pag_grain_num[pag_ind]))
+                ava_list.append(info_tuple)
         # sort by package number and grain number
         sorted_list = sorted(ava_list, key=lambda tuple:(tuple[1], tuple[2]), reverse=True)
         
@@ -9,8 +9,18 @@
 # @Last Modified At: 2021-04-28 09:56:20
 # @Description: Export average package number of PAG from material bank json.
 
+import argparse
 import json
 import os
+import re
+
+import numpy as np
+
+from compile_bank import CompiledMatBank
+
+# tokens of json file which change nesting depth, strings are matched
+# as a whole so that brackets inside names are ignored
+JSON_TOKEN_RE = re.compile(rb'"(?:[^"\\\n]|\\.)*"|[{}\[\]]')
 
 def load_json(json_path):
     """ load .json file and export it as dictionary """
@@ -48,16 +58,133 @@ def calc_mean_pck(ori_dict):
         print("\nError! Failed to calculate average package number: **Zero Division**\n")
         return 0
 
+def _group_count(opens, members, carry):
+    """
+        given flags of group opening events and member events in order, count members
+        of each group, where members before first opening belong to the group carried
+        from previous block. Return (counts of closed groups, count of current group)
+    """
+
+    group_inds = np.cumsum(opens)[members]
+    counts = np.bincount(group_inds, minlength=int(opens.sum()) + 1)
+    counts[0] = counts[0] + carry
+
+    return (counts[:-1], int(counts[-1]))
+
+def _hist_add(hist, counts):
+    """ add counts to histogram, where hist[n] is frequency of count n """
+
+    if len(counts) == 0:
+        return hist
+    counts_hist = np.bincount(counts)
+    if len(counts_hist) > len(hist):
+        hist = np.concatenate((hist, np.zeros(len(counts_hist) - len(hist), dtype=np.int64)))
+    hist[:len(counts_hist)] = hist[:len(counts_hist)] + counts_hist
+
+    return hist
+
+def stream_statistics(json_path, block_size=1 << 24):
+    """
+        count packages per PAG, grains per package and grains per PAG in one pass
+        over material bank json, block by block, return histograms of these counts
+    """
+
+    hists = {"pck_per_pag": np.zeros(0, dtype=np.int64), "grains_per_pck": np.zeros(0, dtype=np.int64), \
+        "grains_per_pag": np.zeros(0, dtype=np.int64)}
+    # counts of PAG and package still open at end of previous block
+    carries = {"pck_per_pag": 0, "grains_per_pck": 0, "grains_per_pag": 0}
+    # nesting depth at end of previous block, and whether a PAG or package is open
+    depth = 0
+    (pag_open, pck_open) = (False, False)
+    with open(json_path, 'rb') as ori_json:
+        rest = b''
+        while True:
+            block = ori_json.read(block_size)
+            # json strings never contain line breaks, so blocks are cut after last line break
+            buffer = rest + block
+            cut = buffer.rfind(b'\n') + 1 if len(block) != 0 else len(buffer)
+            if cut == 0 and len(block) != 0:
+                rest = buffer
+                continue
+            (buffer, rest) = (buffer[:cut], buffer[cut:])
+            tokens = np.frombuffer(b''.join(token[:1] for token in JSON_TOKEN_RE.findall(buffer)), dtype=np.uint8)
+            # depth after each token, PAG is object at depth 2, package is array at depth 3
+            # and grain is object at depth 4
+            delta = np.isin(tokens, (ord('{'), ord('['))).astype(np.int64) - \
+                np.isin(tokens, (ord('}'), ord(']'))).astype(np.int64)
+            depth_after = depth + np.cumsum(delta)
+            pag_opens = (tokens == ord('{')) & (depth_after == 2)
+            pck_opens = (tokens == ord('[')) & (depth_after == 3)
+            grains = (tokens == ord('{')) & (depth_after == 4)
+            for (hist_name, opens, members, group_open) in (("pck_per_pag", pag_opens, pck_opens, pag_open), \
+                ("grains_per_pck", pck_opens, grains, pck_open), ("grains_per_pag", pag_opens, grains, pag_open)):
+                (closed_counts, carries[hist_name]) = _group_count(opens, members, carries[hist_name])
+                # counts before first opening belong to no group if none was open
+                closed_counts = closed_counts if group_open else closed_counts[1:]
+                hists[hist_name] = _hist_add(hists[hist_name], closed_counts)
+            if pag_opens.any():
+                pag_open = True
+            if pck_opens.any():
+                pck_open = True
+            depth = int(depth_after[-1]) if len(depth_after) != 0 else depth
+            if len(block) == 0:
+                break
+    # groups open at end of file
+    if pag_open:
+        hists["pck_per_pag"] = _hist_add(hists["pck_per_pag"], np.array([carries["pck_per_pag"]]))
+        hists["grains_per_pag"] = _hist_add(hists["grains_per_pag"], np.array([carries["grains_per_pag"]]))
+    if pck_open:
+        hists["grains_per_pck"] = _hist_add(hists["grains_per_pck"], np.array([carries["grains_per_pck"]]))
+
+    return hists
+
+def compiled_statistics(json_path):
+    """ return histograms from compiled bank if its cache is valid and readable, otherwise None """
+
+    try:
+        bank = CompiledMatBank(json_path, auto_compile=False)
+    except (OSError, ValueError, KeyError):
+        return None
+    if bank.pag_pck_num is None:
+        return None
+
+    return {"pck_per_pag": _hist_add(np.zeros(0, dtype=np.int64), bank.pag_pck_num), \
+        "grains_per_pck": _hist_add(np.zeros(0, dtype=np.int64), bank.pck_sizes), \
+            "grains_per_pag": _hist_add(np.zeros(0, dtype=np.int64), bank.pag_grain_num)}
+
+def bank_statistics(json_path, use_compiled=True):
+    """ return histograms of material bank, from compiled bank when available """
+
+    hists = compiled_statistics(json_path) if use_compiled else None
+    if hists is None:
+        hists = stream_statistics(json_path)
+
+    return hists
+
+def print_statistics(mat_name, hists):
+    """ print summary and histograms of material bank """
+
+    pag_num = int(hists["pck_per_pag"].sum())
+    pck_num = int(hists["grains_per_pck"].sum())
+    grain_num = int(np.dot(np.arange(len(hists["grains_per_pck"])), hists["grains_per_pck"]))
+    print("\nMaterial {}: {} PAGs, {} Packages, {} Grains".format(mat_name, pag_num, pck_num, grain_num))
+    for (hist_name, title) in (("pck_per_pag", "Packages per PAG"), ("grains_per_pck", "Grains per Package"), \
+        ("grains_per_pag", "Orientations per PAG")):
+        hist = hists[hist_name]
+        mean = float(np.dot(np.arange(len(hist)), hist) / hist.sum()) if hist.sum() != 0 else 0.0
+        print("\n{} (mean {:.3f}):".format(title, mean))
+        for count in np.flatnonzero(hist).tolist():
+            print("{:>8d} : {}".format(count, int(hist[count])))
+
 if __name__ == "__main__":
-    # material bank path
-    json_path = "matbank/Bainite_1300.json"
+    parser = argparse.ArgumentParser(description="Print statistics of material bank json.")
+    parser.add_argument("json_path", nargs='?', default="matbank/Bainite_1300.json", help="material bank path")
+    parser.add_argument("--stream", action="store_true", help="always stream json file, ignore compiled bank")
+    args = parser.parse_args()
     # material name
-    (file_path, file_name) = os.path.split(json_path)
+    (file_path, file_name) = os.path.split(args.json_path)
     (mat_name, extension) = os.path.splitext(file_name)
-    # ori dict
-    ori_dict = load_json(json_path=json_path)
-    # calculation
-    mean_pck = calc_mean_pck(ori_dict=ori_dict)
+    # statistics
+    hists = bank_statistics(args.json_path, use_compiled=not args.stream)
     # print
-    print("\nAverage Package Number of material {} is: {}".format(mat_name, str(mean_pck)))
-
+    print_statistics(mat_name, hists)
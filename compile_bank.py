@@ -0,0 +1,268 @@
+# Copyright (c) 2021 Xiang Hu
+#
+# -*- coding:utf-8 -*-
+# @Script: compile_bank.py
+# @Author: Xiang Hu
+# @Email: xiang.hu@rwth-aachen.de
+# @Create At: 2026-10-17 09:12:40
+# @Last Modified By: Xiang Hu
+# @Last Modified At: 2026-10-17 09:12:40
+# @Description: Compile material bank json into memory-mappable arrays.
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# file locks are only available on POSIX, elsewhere cache is used without locks
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class CompiledMatBank():
+    """
+        A class for compiling material bank json exported by
+        CreateHierarchOriJson into flat arrays, which are cached
+        beside the json file and memory-mapped on load.
+    """
+
+    # bump when layout of cached arrays changes
+    version = 1
+    # names of cached arrays
+    array_names = ("ori", "pck_offsets", "pag_offsets", "pck_sizes", "pck_sorted", \
+        "pag_pck_num", "pag_grain_num", "pag_signatures")
+
+    def __init__(self, ori_json_path, cache_dir=None, auto_compile=True):
+        """
+            initialize the properties and load or compile the bank,
+            if auto_compile is False only a valid cache is loaded
+        """
+
+        # pass arguments to parameters
+        self.ori_json_path = ori_json_path
+        self.cache_dir = cache_dir if cache_dir is not None else str(ori_json_path) + ".cache"
+        # names, in order of json file
+        self.pag_names = []
+        self.pck_names = []
+        self.pag_index = {}
+        # arrays
+        # orientations (phi1, phi, phi2) of all grains, grouped by package
+        self.ori = None
+        # grains of package p are ori[pck_offsets[p]:pck_offsets[p+1]]
+        self.pck_offsets = None
+        # packages of PAG a are pck_offsets[pag_offsets[a]:pag_offsets[a+1]]
+        self.pag_offsets = None
+        # grain number of each package
+        self.pck_sizes = None
+        # package indices sorted by grain number in descending order within each PAG
+        self.pck_sorted = None
+        # package number and grain number of each PAG
+        self.pag_pck_num = None
+        self.pag_grain_num = None
+        # sorted package sizes of each PAG, padded with zeros
+        self.pag_signatures = None
+        # auto run, json file must exist before any lock file is created
+        self.__json_stat()
+        # cache is validated and loaded under a shared lock,
+        # and compiled under an exclusive lock by one run only
+        with self.__cache_lock(exclusive=False):
+            if self.__cache_valid():
+                self.__cache_load()
+                return
+        if not auto_compile:
+            return
+        with self.__cache_lock(exclusive=True):
+            # cache may be compiled by another run while waiting for lock
+            if not self.__cache_valid():
+                self.__cache_build()
+            self.__cache_load()
+
+    @contextlib.contextmanager
+    def __cache_lock(self, exclusive):
+        """
+            hold a lock on lock file beside cache directory, which itself is replaced on compiling.
+            Only the exclusive lock for compiling creates the lock file, a shared lock is skipped
+            if the lock file does not exist or cannot be opened, e.g. on read-only bank location,
+            since the cache directory is only ever replaced as a whole.
+        """
+
+        if fcntl is None:
+            yield
+            return
+        lock_path = self.cache_dir.rstrip(os.sep) + ".lock"
+        if exclusive:
+            lock_file = open(lock_path, 'a')
+        else:
+            try:
+                lock_file = open(lock_path, 'r')
+            except OSError:
+                yield
+                return
+        with lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def __json_stat(self):
+        """ return modification time and size of json file """
+
+        json_stat = os.stat(self.ori_json_path)
+
+        return (json_stat.st_mtime_ns, json_stat.st_size)
+
+    def __json_hash(self):
+        """ return sha1 hash of json file """
+
+        sha1 = hashlib.sha1()
+        with open(self.ori_json_path, 'rb') as mat_ori_json:
+            for block in iter(lambda: mat_ori_json.read(1 << 20), b''):
+                sha1.update(block)
+
+        return sha1.hexdigest()
+
+    def __meta_path(self):
+        """ return path of meta file in cache directory """
+
+        return os.path.join(self.cache_dir, "meta.json")
+
+    def __cache_valid(self):
+        """ tell whether cached arrays belong to current json file """
+
+        try:
+            with open(self.__meta_path()) as meta_file:
+                meta = json.loads(meta_file.read())
+        except (FileNotFoundError, ValueError):
+            return False
+        if meta.get("version") != self.version:
+            return False
+        (mtime_ns, size) = self.__json_stat()
+        if meta["json_mtime_ns"] == mtime_ns and meta["json_size"] == size:
+            return True
+        # json touched but maybe not changed, modification time is updated if cache is writable
+        if meta["json_size"] == size and meta["json_sha1"] == self.__json_hash():
+            meta["json_mtime_ns"] = mtime_ns
+            try:
+                self.__atomic_write(self.__meta_path(), lambda tmp_file: tmp_file.write(json.dumps(meta).encode()))
+            except OSError:
+                pass
+            return True
+
+        return False
+
+    def __atomic_write(self, file_path, write_function):
+        """ write a file through a uniquely named temporary file and rename it """
+
+        (tmp_fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+        try:
+            with os.fdopen(tmp_fd, 'wb') as tmp_file:
+                write_function(tmp_file)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def compile(self):
+        """ parse json file once and save bank as flat arrays in cache directory """
+
+        with self.__cache_lock(exclusive=True):
+            self.__cache_build()
+
+    def __cache_build(self):
+        """
+            compile bank into a temporary directory beside cache directory and
+            rename it into place, the caller holds the exclusive cache lock
+        """
+
+        (mtime_ns, size) = self.__json_stat()
+        json_sha1 = self.__json_hash()
+        with open(self.ori_json_path) as mat_ori_json:
+            mat_ori_dict = json.loads(mat_ori_json.read())
+
+        # flatten in order of json file
+        pag_names = []
+        pck_names = []
+        pck_sizes = []
+        pag_pck_num = []
+        ori_list = []
+        for (pag_name, pck_dict) in mat_ori_dict.items():
+            pag_names.append(pag_name)
+            pag_pck_num.append(len(pck_dict))
+            for (pck_name, grains_list) in pck_dict.items():
+                pck_names.append(pck_name)
+                pck_sizes.append(len(grains_list))
+                ori_list.extend([(grain["phi1"], grain["phi"], grain["phi2"]) for grain in grains_list])
+        arrays = {}
+        arrays["ori"] = np.array(ori_list, dtype=np.float64).reshape(-1, 3)
+        arrays["pck_sizes"] = np.array(pck_sizes, dtype=np.int64)
+        arrays["pag_pck_num"] = np.array(pag_pck_num, dtype=np.int64)
+        arrays["pck_offsets"] = np.concatenate(([0], np.cumsum(arrays["pck_sizes"]))).astype(np.int64)
+        arrays["pag_offsets"] = np.concatenate(([0], np.cumsum(arrays["pag_pck_num"]))).astype(np.int64)
+        arrays["pag_grain_num"] = arrays["pck_offsets"][arrays["pag_offsets"][1:]] - \
+            arrays["pck_offsets"][arrays["pag_offsets"][:-1]]
+        # packages sorted by size within each PAG, stable for equal sizes
+        pck_pag = np.repeat(np.arange(len(pag_names)), arrays["pag_pck_num"])
+        arrays["pck_sorted"] = np.lexsort((-arrays["pck_sizes"], pck_pag)).astype(np.int64)
+        # package size signatures, padded with zeros
+        max_pck_num = int(arrays["pag_pck_num"].max()) if len(pag_names) != 0 else 0
+        signatures = np.zeros((len(pag_names), max_pck_num), dtype=np.int64)
+        pck_rank = np.arange(len(pck_sizes)) - np.repeat(arrays["pag_offsets"][:-1], arrays["pag_pck_num"])
+        signatures[pck_pag, pck_rank] = arrays["pck_sizes"][arrays["pck_sorted"]]
+        arrays["pag_signatures"] = signatures
+
+        # save arrays and meta file into a new directory, which replaces cache directory when complete
+        (cache_parent, cache_name) = os.path.split(os.path.abspath(self.cache_dir))
+        build_dir = tempfile.mkdtemp(dir=cache_parent, prefix=cache_name + ".build.")
+        try:
+            for array_name in self.array_names:
+                np.save(os.path.join(build_dir, array_name + ".npy"), arrays[array_name])
+            meta = {"version": self.version, "json_mtime_ns": mtime_ns, "json_size": size, \
+                "json_sha1": json_sha1, "pag_names": pag_names, "pck_names": pck_names}
+            with open(os.path.join(build_dir, "meta.json"), 'w') as meta_file:
+                meta_file.write(json.dumps(meta))
+            # old cache is moved aside first, arrays memory-mapped from it stay valid
+            old_dir = None
+            if os.path.exists(self.cache_dir):
+                old_dir = tempfile.mkdtemp(dir=cache_parent, prefix=cache_name + ".old.")
+                os.replace(self.cache_dir, os.path.join(old_dir, cache_name))
+            os.replace(build_dir, self.cache_dir)
+            if old_dir is not None:
+                shutil.rmtree(old_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+
+    def __cache_load(self):
+        """ load names and memory-map cached arrays """
+
+        with open(self.__meta_path()) as meta_file:
+            meta = json.loads(meta_file.read())
+        self.pag_names = meta["pag_names"]
+        self.pck_names = meta["pck_names"]
+        self.pag_index = {pag_name: ind for (ind, pag_name) in enumerate(self.pag_names)}
+        for array_name in self.array_names:
+            setattr(self, array_name, np.load(os.path.join(self.cache_dir, array_name + ".npy"), mmap_mode='r'))
+
+    def pag_packages(self, pag_ind):
+        """ return package indices of given PAG, sorted by grain number in descending order """
+
+        return self.pck_sorted[self.pag_offsets[pag_ind]:self.pag_offsets[pag_ind+1]]
+
+    def pck_ori(self, pck_ind):
+        """ return orientation rows (phi1, phi, phi2) of given package """
+
+        return self.ori[self.pck_offsets[pck_ind]:self.pck_offsets[pck_ind+1]]
+
+if __name__ == "__main__":
+    # material bank path
+    ori_json_path = "matbank/Bainite_1300.json"
+    bank = CompiledMatBank(ori_json_path)
+    print("\nCompiled {} PAGs, {} Packages and {} Grains.\n".format(\
+        len(bank.pag_names), len(bank.pck_names), len(bank.ori)))
@@ -10,6 +10,12 @@
 # @Description: Parse tess file and stelset file, generate input files.
 
 import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
 from grains_parse import GrainsParse
 from nodes_parse import NodesParse
 from read_hierarchical import HierarchicalRead
@@ -22,31 +28,65 @@ class FileScanner():
         materials.inp, sections.inp, and periodic input files.
     """
 
-    def __init__(self, dir_path, load_condition, only_graindata=True, pbc=False, hierarchical_ori=True):
+    def __init__(self, dir_path, load_condition, only_graindata=True, pbc=False, hierarchical_ori=True, \
+        geometric_boundary=False, compact_pbc=False, output_dir=None, assignment="greedy", \
+        seed=None, distribution_materials=False, mat_bank_path="/mnt/d/Git/rve_pbc/matbank/Bainite_1300.json", \
+        node_workers=None):
         """ initialize the properties"""
 
         # get input arguments
-        self.dir_path = dir_path
+        # input files are read from dir_path, output files are written to output_dir
+        self.dir_path = os.path.abspath(dir_path)
+        self.output_dir = os.path.abspath(output_dir) if output_dir is not None else self.dir_path
         # container
         # grains containers
-        self.ori_dict = {}
-        self.dia_dict = {}
+        # euler angles and equivalent diameters, row i is grain i+1
+        self.ori = np.zeros((0, 3))
+        self.dia = np.zeros(0)
         # nodes containers
         self.face_nodes = {}
         self.edge_nodes = {}
         self.vertice_nodes = {}
+        # periodic node pairs, in which (positive set, negative set) are keys
+        # and label arrays aligned by node position are values
+        self.node_pairs = {}
         # file path
         self.tess_file_path = None
         self.stelset_file_path = None
         self.stcell_file_path = None
         self.final_inp_file_path = None
+        # output file names, which are included by name in final input file
+        self.section_file = None
+        self.material_file = None
+        # table of grain constants distribution, model data included before parts
+        self.distribution_table_file = None
+        self.f_pbc_file_name = {'X': "LeftToRight", 'Y': "BottomToTop", 'Z': "FrontToRear"}
+        self.edge_inp_file_name = "Edges"
+        self.corners_input_file_name = "Corners"
+        self.vertices_input_file_name = "VerticeSets"
         # pass signals
         self.only_graindata_inp = only_graindata
         self.pbc = pbc
         self.loading_condition = load_condition
         self.hierarchical_ori = hierarchical_ori
+        self.geometric_boundary = geometric_boundary
+        # write one equation per set couple instead of one per node pair
+        self.compact_pbc = compact_pbc
+        # number of processes parsing large nodes blocks, None for all cores
+        self.node_workers = node_workers
+        # material bank json file of hierarchical orientation
+        self.mat_bank_path = os.path.abspath(mat_bank_path)
+        # assignment mode of hierarchical orientation, "greedy" or "optimal"
+        self.assignment = assignment
+        # one shared material with grain constants given by a distribution,
+        # instead of one section and material per grain
+        self.distribution_materials = distribution_materials
+        self.distribution_name = "Grain_Mat_Constants"
+        # seed of random orientation extension, recorded in graindata file
+        self.seed = seed
 
         # automatically run
+        os.makedirs(self.output_dir, exist_ok=True)
         self.__files_scan()
         self.__run()
 
@@ -58,61 +98,130 @@ class FileScanner():
             self.stelset_file_path != None and self.stcell_file_path != None:
             # GrainsParse 
             grains = GrainsParse(self.tess_file_path, self.stelset_file_path)
-            if self.hierarchical_ori:
-                # Hierarchical Orientation from EBSD Data
-                hierarch = HierarchicalRead(self.stcell_file_path)
-                hierarch_dict = hierarch.read_hierarch()
-                assign = AssignOriToRve(ori_json_path="/mnt/d/Git/rve_pbc/matbank/Bainite_1300.json", hierarch_dict=hierarch_dict)
-                # assign ori_dict in Class AssignOriToRve()
-                self.ori_dict = assign.assigned_ori_dict
-            else:
-                # Random Orientation from Neper
-                self.ori_dict = grains.read_ori()
-            self.dia_dict = grains.read_eqvdiam()
+            # stages as name: (function, dependencies), parse stages first
+            stages = {
+                "ori": (lambda: self.__ori_read(grains), []),
+                "dia": (lambda: self.__dia_read(grains), []),
+                "graindata": (self.__write_graindata, ["ori", "dia"]),
+            }
             # if only graindata.inp is required
             if self.only_graindata_inp:
-                self.__write_graindata()
+                pass
             # otherwise
             else:
+                # write input rows, namely sections and materials
+                stages["grain_input"] = (self.__grain_input_stage, ["graindata"])
                 # if periodical boundary conditions are required
                 if self.pbc:
-                    # NodesParse
-                    nodes = NodesParse(self.final_inp_file_path)
-                    self.face_nodes = nodes.faces
-                    self.edge_nodes = nodes.edges
-                    self.vertice_nodes = nodes.vertices
-                    # write input files
-                    if self.final_inp_file_path != None and self.__write_graindata():
-                        self.__write_grain_input()
-                        if (len(self.face_nodes) != 0) and (len(self.edge_nodes) != 0) and (len(self.vertice_nodes) != 0):
-                            self.__write_face_input()
-                            self.__write_edge_input()
-                            self.__write_corners_input()
-                            self.__write_vertice_input()
-                            self.__write_final_input()
-                        else:
-                            print("\nError! No Node Information Have Been Found!\n")
-                    else:
-                        print("\nError! Mesh file cannot be parsed!\n\n")
-                # otherwise
-                else:
-                    # write input rows, namely sections and materials
-                    if self.final_inp_file_path != None and self.__write_graindata():
-                        self.__write_grain_input()
-                    else:
-                        print("\nError! Mesh file cannot be parsed!\n\n")
+                    stages["nodes"] = (self.__nodes_read, [])
+                    # write periodic input files once nodes are paired
+                    for normal_axis in ['X', 'Y', 'Z']:
+                        stages["face_"+normal_axis] = \
+                            (lambda normal_axis=normal_axis: self.__write_face_input(normal_axis), ["nodes"])
+                    stages["edges"] = (self.__write_edge_input, ["nodes"])
+                    stages["corners"] = (self.__write_corners_input, ["nodes"])
+                    stages["vertices"] = (self.__write_vertice_input, ["nodes"])
+                    # final input waits on all other stages
+                    stages["final"] = (self.__write_final_input, \
+                        [stage_name for stage_name in stages.keys() if stage_name != "nodes"])
+            self.stages_run(stages)
         else:
             print("\nError! Tess or Stelset or Stcell File cannot be Found!\n\n")
 
+    def stages_run(self, stages, max_workers=None):
+        """
+            Given stages as dictionary {name: (function, dependency names)}, run
+            each stage on a thread pool as soon as all its dependencies finished.
+            A stage returning False fails, and stages depending on it are skipped
+            and marked as failed. Return dictionary of stage results.
+        """
+
+        results = {}
+        pending = dict(stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while len(pending) != 0 or len(running) != 0:
+                # submit or skip stages whose dependencies are finished
+                ready_found = True
+                while ready_found:
+                    ready_found = False
+                    for (stage_name, (function, dependencies)) in list(pending.items()):
+                        if all(dep in results for dep in dependencies):
+                            ready_found = True
+                            pending.pop(stage_name)
+                            if any(results[dep] is False for dep in dependencies):
+                                results[stage_name] = False
+                            else:
+                                running[executor.submit(function)] = stage_name
+                if len(running) == 0:
+                    if len(pending) != 0:
+                        raise ValueError("Stages {} have unknown or cyclic dependencies".format(list(pending.keys())))
+                    break
+                # collect finished stages
+                (done, not_done) = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+
+        return results
+
+    def __ori_read(self, grains):
+        """ read orientation, either hierarchical from material bank or random from Neper """
+
+        if self.hierarchical_ori:
+            # Hierarchical Orientation from EBSD Data
+            hierarch = HierarchicalRead(self.stcell_file_path)
+            hierarch_dict = hierarch.read_hierarch()
+            assign = AssignOriToRve(ori_json_path=self.mat_bank_path, hierarch_dict=hierarch_dict, \
+                assignment=self.assignment, seed=self.seed)
+            # assigned orientation in Class AssignOriToRve()
+            self.ori = assign.assigned_ori
+            self.seed = assign.seed
+        else:
+            # Random Orientation from Neper
+            self.ori = grains.read_ori()
+
+    def __dia_read(self, grains):
+        """ read equivalent diameters """
+
+        self.dia = grains.read_eqvdiam()
+
+    def __grain_input_stage(self):
+        """ write sections and materials if mesh file is found """
+
+        if self.final_inp_file_path != None:
+            self.__write_grain_input()
+        else:
+            print("\nError! Mesh file cannot be parsed!\n\n")
+            return False
+
+    def __nodes_read(self):
+        """ parse nodes of mesh and pair periodic node sets """
+
+        if self.final_inp_file_path == None:
+            return False
+        # NodesParse
+        nodes = NodesParse(self.final_inp_file_path, geometric_boundary=self.geometric_boundary, \
+            workers=self.node_workers)
+        # node sets are stored as node rows, convert them to node labels
+        self.face_nodes = {name: nodes.row_to_label(rows) for (name, rows) in nodes.faces.items()}
+        self.edge_nodes = {name: nodes.row_to_label(rows) for (name, rows) in nodes.edges.items()}
+        self.vertice_nodes = {name: nodes.row_to_label(rows) for (name, rows) in nodes.vertices.items()}
+        if (len(self.face_nodes) != 0) and (len(self.edge_nodes) != 0) and (len(self.vertice_nodes) != 0):
+            if self.__pbc_pairs_find(nodes):
+                return True
+            else:
+                print("\nError! Periodic Node Pairs cannot be Found!\n")
+                return False
+        else:
+            print("\nError! No Node Information Have Been Found!\n")
+            return False
 
     def __files_scan(self):
         """
             Find .tess file in directory
         """
 
-        os.chdir(self.dir_path)
-
-        with os.scandir(os.getcwd()) as current_files:
+        with os.scandir(self.dir_path) as current_files:
             for current_file in current_files:
                 if current_file.is_file():
                     # extraction file extensions
@@ -134,44 +243,35 @@ class FileScanner():
 
     def __write_graindata(self):
         """
-            Import orientation dictionary and eqv_diameter dictionary
-            Merge them and Export to graindata file
+            Import orientation array and eqv_diameter array
+            Merge them and Export to graindata file in one write
         """
 
         # grain data file name
         output_file = 'graindata.inp'
-        # check if the dimensions of two dictionaries are same
-        if len(list(self.ori_dict.keys())) < len(list(self.dia_dict.keys())):
-            print("\n\nError! Dictionaries Dimensions do not match!\n")
+        # check if the dimensions of two arrays are same
+        if len(self.ori) < len(self.dia):
+            print("\n\nError! Orientation and Diameter Dimensions do not match!\n")
             return False
-        else:
-            with open(output_file, 'w') as output_file:
-                title = "!MMM Crystal Plasticity Input File\n\n"
-                output_file.write(title)
-                # loop all grains by index
-                for key in range(len(list(self.ori_dict.keys()))):
-                    try:
-                        key = str(key+1)
-                        # modify decimal
-                        eqv_diam = "%.3f" % float(self.dia_dict[key])
-                        phi_1_f = float(self.ori_dict[key]['phi1']) if float(self.ori_dict[key]['phi1']) > 0 else float(self.ori_dict[key]['phi1'])+360.0 
-                        phi_1 = "%.3f" % phi_1_f
-                        # phi_1 = "197.0"
-                        phi_f = float(self.ori_dict[key]['phi']) if float(self.ori_dict[key]['phi']) > 0 else float(self.ori_dict[key]['phi'])+360.0 
-                        phi   = "%.3f" % phi_f
-                        # phi = "143.0"
-                        phi_2_f = float(self.ori_dict[key]['phi2']) if float(self.ori_dict[key]['phi2']) > 0 else float(self.ori_dict[key]['phi2'])+360.0 
-                        phi_2 = "%.3f" % phi_2_f
-                        # phi_2 = "191.0"
-                        # generate line to write
-                        to_write_line = "Grain : %(key)s : %(phi1)s : %(phi)s : %(phi2)s : %(eqv_dia)s\n" % \
-                            {"key": key, "phi1":phi_1, "phi":phi, "phi2":phi_2, "eqv_dia":eqv_diam}
-                        # write line
-                        output_file.write(to_write_line)
-                    except KeyError:
-                        print("\n\nWarning! Ori-Dictionary does not match Diameter Dictionary!\n")
-                        pass
-            return True
+        elif len(self.ori) > len(self.dia):
+            print("\n\nWarning! {} Orientations do not match {} Diameters, Only {} Grains are Written!\n".format(\
+                len(self.ori), len(self.dia), len(self.dia)))
+        grain_num = len(self.dia)
+        # angles are shifted into positive range
+        angles = np.asarray(self.ori[:grain_num], dtype=np.float64)
+        angles = np.where(angles > 0, angles, angles + 360.0)
+        title = "!MMM Crystal Plasticity Input File\n\n"
+        # record seed so that hierarchical orientations can be reproduced
+        if self.hierarchical_ori:
+            title = "!MMM Crystal Plasticity Input File\n!Orientation Seed: {}\n\n".format(self.seed)
+        # format all grains at once with 3 decimals
+        template = "Grain : {} : {:.3f} : {:.3f} : {:.3f} : {:.3f}\n"
+        lines = "".join(map(template.format, range(1, grain_num+1), angles[:, 0].tolist(), \
+            angles[:, 1].tolist(), angles[:, 2].tolist(), np.asarray(self.dia, dtype=np.float64).tolist()))
+        with open(self.output_path(output_file), 'w') as output_file:
+            output_file.write(title + lines)
+
+        return True
 
     def __write_grain_input(self):
         """
@@ -184,18 +284,22 @@ class FileScanner():
         (file_path, file_name) = os.path.split(self.final_inp_file_path)
         (file_name, extension) = os.path.splitext(file_name)
         # section file
-        global section_file
-        section_file = file_name + '_sections.inp'
+        self.section_file = file_name + '_sections.inp'
         # material file
-        global material_file
-        material_file = file_name + '_materials.inp'
+        self.material_file = file_name + '_materials.inp'
 
         # Flow curve
         flow_curve = "0.00056313, 	0.000\n0.000723443,	0.01\n0.000836414,	0.02\n0.000916023,	0.03\n0.000972122,	0.04\n0.001011655,	0.05\n0.001039513,	0.06\n0.001059145,	0.07\n0.001072979,	0.08\n0.001082727,	0.09\n0.001089597,	0.1\n"
 
-        with open(section_file,'w') as sec_file:
-            with open(material_file, 'w') as mat_file:
-                for ind in range(1, 1+len(list(self.dia_dict.keys()))):
+        # one shared material, grain index is passed by distribution
+        if self.distribution_materials:
+            self.distribution_table_file = file_name + '_distribution_table.inp'
+            self.__write_distribution_input()
+            return
+
+        with open(self.output_path(self.section_file),'w') as sec_file:
+            with open(self.output_path(self.material_file), 'w') as mat_file:
+                for ind in range(1, 1+len(self.dia)):
                     sec_str = "**Section: Section-%(ind)s\n*Solid Section, elset=poly%(ind)s, material=Grain_Mat%(ind)s\n,\n" % \
                         {"ind": str(ind)}
                     # sec_str = "**Section: Section-%(ind)s\n*Solid Section, elset=poly%(ind)s, material=phase1_%(ind)s\n,\n" % \
@@ -208,6 +312,35 @@ class FileScanner():
                     sec_file.write(sec_str)
                     mat_file.write(mat_str)
 
+    def __write_distribution_input(self):
+        """
+            Write one section over all grains and one shared user material,
+            whose constants (grain index, 3.) are given per grain elset by
+            an element-based distribution, instead of one section and
+            material per grain. The table of the distribution is model
+            data, thus written to its own file to be included before parts.
+        """
+
+        grain_inds = range(1, 1+len(self.dia))
+        # element set of all grain element sets, 16 per line
+        grain_elsets = ["poly" + str(ind) for ind in grain_inds]
+        elset_lines = [", ".join(grain_elsets[ind:ind+16]) for ind in range(0, len(grain_elsets), 16)]
+        # constants of each grain, same as constants of material per grain
+        dist_lines = "".join(map("poly{0}, {0}., 3.\n".format, grain_inds))
+        sec_str = "*Elset, elset=AllGrains\n" + "".join(line + "\n" for line in elset_lines) + \
+            "*Distribution, name={}, location=ELEMENT, table={}\n, 0., 3.\n".format(\
+                self.distribution_name, self.distribution_name + "_Table") + dist_lines + \
+                    "**Section: Section-AllGrains\n*Solid Section, elset=AllGrains, material=Grain_Mat\n,\n"
+        mat_str = "*Material, name=Grain_Mat\n*Depvar\n\t176,\n*User Material, constants=2\n" + \
+            self.distribution_name + "\n"
+        table_str = "*Distribution Table, name={}\nSCALAR, SCALAR\n".format(self.distribution_name + "_Table")
+        with open(self.output_path(self.distribution_table_file), 'w') as table_file:
+            table_file.write(table_str)
+        with open(self.output_path(self.section_file), 'w') as sec_file:
+            sec_file.write(sec_str)
+        with open(self.output_path(self.material_file), 'w') as mat_file:
+            mat_file.write(mat_str)
+
     def pattern_str(self, node_positive, node_negative, v_n_pos, v_n_neg, direction):
         """ Generate pattern string, which should be written in input file """
         
@@ -234,12 +367,61 @@ class FileScanner():
 
         return string
 
-    def write_node_face_pbc(self, file_name, face_normal_axis):
+    def pattern_block_write(self, input_file, nodes_positive, nodes_negative, v_n_pos, v_n_neg, direction, \
+        chunk_size=100000):
         """
-            Given axis which face node sets belong to, whose 
-            information should be written as part of pattern 
-            string in new input file through a loop.
+            Generate pattern strings of all node pairs in one batched
+            formatting step and write them in large chunks, output is
+            identical to calling pattern_str for each node pair.
+        """
+
+        # initial char to indicate direction
+        d_ind = {'X': '1', 'Y': '2', 'Z': '3'}.get(direction, '')
+        if d_ind == '':
+            return
+        # pattern template, vertice nodes are same for all node pairs
+        template = "*Equation \n4 \n{}," + d_ind + ",1 \n{}," + d_ind + ",-1 \n" + \
+            str(v_n_neg) + "," + d_ind + ",-1 \n" + str(v_n_pos) + "," + d_ind + ",1 \n"
+        nodes_positive = np.asarray(nodes_positive).tolist()
+        nodes_negative = np.asarray(nodes_negative).tolist()
+        # write chunk by chunk
+        for chunk_beg in range(0, len(nodes_positive), chunk_size):
+            chunk_end = chunk_beg + chunk_size
+            input_file.write("".join(map(template.format, \
+                nodes_positive[chunk_beg:chunk_end], nodes_negative[chunk_beg:chunk_end])))
+
+    def pattern_nset_write(self, input_file, set_name, set_nodes):
+        """ Write an ordered node set definition, 16 nodes per line """
+
+        set_nodes = np.asarray(set_nodes).tolist()
+        # empty sets are not allowed in equations, skip them
+        if len(set_nodes) == 0:
+            return
+        set_lines = [", ".join(map(str, set_nodes[ind:ind+16])) for ind in range(0, len(set_nodes), 16)]
+        input_file.write("*Nset, nset=%(name)s, unsorted\n" % {"name": set_name} + "\n".join(set_lines) + "\n")
+
+    def __pbc_pairs_find(self, nodes):
         """
+            Pair nodes of periodic face sets and edge sets by coordinates,
+            return False if any couple of sets cannot be paired.
+        """
+
+        # couples of positive and negative sets
+        set_couples = [self.__face_pbc_sets(normal_axis)[2:] for normal_axis in ['X', 'Y', 'Z']]
+        for (plane, edge_tuple_list) in self.__edge_pbc_dict().items():
+            set_couples.extend([edge_tuple[0:2] for edge_tuple in edge_tuple_list])
+        # find partner nodes of each couple
+        for (set_p, set_n) in set_couples:
+            partner = nodes.periodic_pair(set_p, set_n)
+            if partner is None:
+                return False
+            rows_p = nodes.faces[set_p] if set_p in nodes.faces else nodes.edges[set_p]
+            self.node_pairs[(set_p, set_n)] = (nodes.row_to_label(rows_p), nodes.row_to_label(partner))
+
+        return True
+
+    def __face_pbc_sets(self, face_normal_axis):
+        """ return vertice nodes and face sets names by axis which face sets belong to """
 
         # determine two vertice nodes by set axis
         # if LeftToRight
@@ -265,14 +447,33 @@ class FileScanner():
             vertice_pos = ''
             f_pos_set = ''
             f_neg_set = ''
-        # determine face sets
+
+        return (vertice_neg, vertice_pos, f_pos_set, f_neg_set)
+
+    def write_node_face_pbc(self, file_name, face_normal_axis):
+        """
+            Given axis which face node sets belong to, whose 
+            information should be written as part of pattern 
+            string in new input file through a loop.
+        """
+
+        (vertice_neg, vertice_pos, f_pos_set, f_neg_set) = self.__face_pbc_sets(face_normal_axis)
+        # determine face sets, paired by node position
         # try:
-        face_set_p = self.face_nodes[f_pos_set]
-        face_set_n = self.face_nodes[f_neg_set]
-        vertice_pos = self.vertice_nodes[vertice_pos][0]
-        vertice_neg = self.vertice_nodes[vertice_neg][0]
+        (face_set_p, face_set_n) = self.node_pairs[(f_pos_set, f_neg_set)]
         # write face pbc input file
-        with open(file_name, 'w') as input_file:
+        with open(self.output_path(file_name), 'w') as input_file:
+            # ordered node sets for compact equations
+            if self.compact_pbc:
+                set_prefix = os.path.splitext(os.path.basename(file_name))[0]
+                set_names = {'P': set_prefix + '_P', 'N': set_prefix + '_N', \
+                    vertice_pos: set_prefix + '_' + vertice_pos, vertice_neg: set_prefix + '_' + vertice_neg}
+                self.pattern_nset_write(input_file, set_names['P'], face_set_p)
+                self.pattern_nset_write(input_file, set_names['N'], face_set_n)
+                self.pattern_nset_write(input_file, set_names[vertice_pos], self.vertice_nodes[vertice_pos][0:1])
+                self.pattern_nset_write(input_file, set_names[vertice_neg], self.vertice_nodes[vertice_neg][0:1])
+            vertice_pos = self.vertice_nodes[vertice_pos][0] if not self.compact_pbc else set_names[vertice_pos]
+            vertice_neg = self.vertice_nodes[vertice_neg][0] if not self.compact_pbc else set_names[vertice_neg]
             for direction in ['X', 'Y', 'Z']:
                 if direction == 'X':
                     first_line_str = "**** {}-DIR \n".format(direction)
@@ -280,27 +481,25 @@ class FileScanner():
                     first_line_str = "**** \n**** {}-DIR \n".format(direction)
                 # first line
                 input_file.write(first_line_str)
-                # loop over set
-                for i in range(len(face_set_p)):
-                    pattern_string = \
-                        self.pattern_str(face_set_p[i], face_set_n[i], \
-                            v_n_pos=vertice_pos, v_n_neg=vertice_neg, direction=direction)
-                    input_file.write(pattern_string)
+                # one equation for the whole set couple
+                if self.compact_pbc:
+                    if len(face_set_p) != 0:
+                        input_file.write(self.pattern_str(set_names['P'], set_names['N'], \
+                            v_n_pos=vertice_pos, v_n_neg=vertice_neg, direction=direction))
+                # all node pairs in set
+                else:
+                    self.pattern_block_write(input_file, face_set_p, face_set_n, \
+                        v_n_pos=vertice_pos, v_n_neg=vertice_neg, direction=direction)
         # except:
         #     print("\n\nError! Failed to Write Face Periodic Condition Input File!\n")
 
-    def __write_face_input(self):
+    def __write_face_input(self, normal_axis):
         """
-            Import face sets, generat periodic input files
+            Import face sets of given normal axis, generat periodic input file
         """
 
-        # create face input file name dict
-        global f_pbc_file_name
-        f_pbc_file_name = {'X': "LeftToRight", 'Y': "BottomToTop", 'Z': "FrontToRear"}
-        # loop over
-        for (normal_axis, file_name) in f_pbc_file_name.items():
-            file_name = file_name + '.inp'
-            self.write_node_face_pbc(file_name, face_normal_axis=normal_axis)
+        file_name = self.f_pbc_file_name[normal_axis] + '.inp'
+        self.write_node_face_pbc(file_name, face_normal_axis=normal_axis)
 
     def write_node_edge_pbc(self, file_name, edge_pbc_dict):
         """
@@ -310,31 +509,52 @@ class FileScanner():
             given input file.
         """
 
+        set_prefix = os.path.basename(file_name)
         file_name = file_name + '.inp'
-        with open(file_name, 'w') as input_file:
+        with open(self.output_path(file_name), 'w') as input_file:
+            # ordered node sets for compact equations, vertice sets are written once
+            set_names = {}
+            if self.compact_pbc:
+                for (plane, edge_tuple_list) in edge_pbc_dict.items():
+                    for edge_tuple in edge_tuple_list:
+                        (edge_set_p, edge_set_n) = self.node_pairs[(edge_tuple[0], edge_tuple[1])]
+                        couple_name = set_prefix + '_' + edge_tuple[0].replace('-', '') + '_' + edge_tuple[1].replace('-', '')
+                        set_names[edge_tuple[0:2]] = (couple_name + '_P', couple_name + '_N')
+                        self.pattern_nset_write(input_file, couple_name + '_P', edge_set_p)
+                        self.pattern_nset_write(input_file, couple_name + '_N', edge_set_n)
+                        for vertice_name in (edge_tuple[2], 'V1'):
+                            if vertice_name not in set_names:
+                                set_names[vertice_name] = set_prefix + '_' + vertice_name
+                                self.pattern_nset_write(input_file, set_names[vertice_name], \
+                                    self.vertice_nodes[vertice_name][0:1])
             for (plane, edge_tuple_list) in edge_pbc_dict.items():
                 for edge_tuple in edge_tuple_list:
-                    # extract information from tuple
-                    edge_set_p = self.edge_nodes[edge_tuple[0]]
-                    edge_set_n = self.edge_nodes[edge_tuple[1]]
-                    vertice_neg = self.vertice_nodes[edge_tuple[2]][0]
-                    vertice_pos = self.vertice_nodes['V1'][0]
+                    # extract information from tuple, edge sets paired by node position
+                    (edge_set_p, edge_set_n) = self.node_pairs[(edge_tuple[0], edge_tuple[1])]
+                    if self.compact_pbc:
+                        vertice_neg = set_names[edge_tuple[2]]
+                        vertice_pos = set_names['V1']
+                    else:
+                        vertice_neg = self.vertice_nodes[edge_tuple[2]][0]
+                        vertice_pos = self.vertice_nodes['V1'][0]
                     # loop over three basic direction
                     for direction in ['X', 'Y', 'Z']:
                         first_line_str = "**** {}-DIR \n".format(direction)
                         # first line
                         input_file.write(first_line_str)
-                        # loop over set
-                        for i in range(len(edge_set_p)):
-                            pattern_str = \
-                                self.pattern_str(edge_set_p[i], edge_set_n[i], \
-                                    v_n_pos=vertice_pos, v_n_neg=vertice_neg, direction=direction)
-                            input_file.write(pattern_str)
+                        # one equation for the whole set couple
+                        if self.compact_pbc:
+                            if len(edge_set_p) != 0:
+                                (set_name_p, set_name_n) = set_names[edge_tuple[0:2]]
+                                input_file.write(self.pattern_str(set_name_p, set_name_n, \
+                                    v_n_pos=vertice_pos, v_n_neg=vertice_neg, direction=direction))
+                        # all node pairs in set
+                        else:
+                            self.pattern_block_write(input_file, edge_set_p, edge_set_n, \
+                                v_n_pos=vertice_pos, v_n_neg=vertice_neg, direction=direction)
 
-    def __write_edge_input(self):
-        """
-            Import edge sets, generat periodic input files
-        """
+    def __edge_pbc_dict(self):
+        """ return periodic relationship of edge sets """
 
         # store periodic condition in a dict
         # key = plane, such as X-Y plane where the edges belong to
@@ -342,11 +562,17 @@ class FileScanner():
         edge_pbc_dict = {'X-Y': [('x1-y1', 'x0-y1', 'V2'), ('x1-y0', 'x0-y0', 'V2'), ('x0-y1', 'x0-y0', 'V4')], \
             'Y-Z': [('y1-z0', 'y1-z1', 'H1'), ('y0-z0', 'y0-z1', 'H1'), ('y1-z1', 'y0-z1', 'V4')], \
                 'Z-X': [('x1-z0', 'x0-z0', 'V2'), ('x1-z1', 'x0-z1', 'V2'), ('x0-z0', 'x0-z1', 'H1')]}
-        # edge input file
-        global edge_inp_file_name
-        edge_inp_file_name = "Edges"
+
+        return edge_pbc_dict
+
+    def __write_edge_input(self):
+        """
+            Import edge sets, generat periodic input files
+        """
+
+        edge_pbc_dict = self.__edge_pbc_dict()
         # run
-        self.write_node_edge_pbc(edge_inp_file_name, edge_pbc_dict)
+        self.write_node_edge_pbc(self.edge_inp_file_name, edge_pbc_dict)
 
     def write_node_vertice_pbc(self, file_name, corners_pbc_dict):
         """
@@ -357,7 +583,7 @@ class FileScanner():
         """
 
         file_name = file_name + '.inp'
-        with open(file_name, 'w') as input_file:
+        with open(self.output_path(file_name), 'w') as input_file:
             for (v_couple_name, vertice_tuple) in corners_pbc_dict.items():
                 # extract information from tuple
                 vertice_1_p = self.vertice_nodes[vertice_tuple[0]][0]
@@ -384,20 +610,15 @@ class FileScanner():
         corners_pbc_dict = {"V3toV4": ('V3', 'V4', 'V2'), \
             "H4toV4": ('H4', 'V4', 'H1'), "H3toV3": ('H3', 'V3', 'H1'), \
                 "H2toV2": ('H2', 'V2', 'H1')}
-        # corners input file
-        global corners_input_file_name
-        corners_input_file_name = "Corners"
         # run
-        self.write_node_vertice_pbc(corners_input_file_name, corners_pbc_dict)
+        self.write_node_vertice_pbc(self.corners_input_file_name, corners_pbc_dict)
 
     def __write_vertice_input(self):
         """ Import vertices dictionary, generate set input file """
 
         # vertices input file
-        global vertices_input_file_name
-        vertices_input_file_name = "VerticeSets"
         instance_name = "TESS-1"
-        with open(vertices_input_file_name+'.inp', 'w') as input_file:
+        with open(self.output_path(self.vertices_input_file_name+'.inp'), 'w') as input_file:
             for (vertice_name, vertice_node) in self.vertice_nodes.items():
                 v_name = str(vertice_name)
                 v_node = str(vertice_node[0]) 
@@ -411,12 +632,27 @@ class FileScanner():
             which will be imported to ABAQUS later.
         """
 
-        #TODO: separate this following part as a single method
-        with open(self.final_inp_file_path, 'r') as mesh_file:
-            lines = mesh_file.read().splitlines()
-
-        # call final method 
-        self.write_input_include(lines)
+        # stream mesh into a temporary file in output directory, and replace
+        # the final input file only if writing succeeded
+        file_name = os.path.basename(self.final_inp_file_path)
+        final_path = self.output_path(file_name)
+        (tmp_fd, tmp_path) = tempfile.mkstemp(prefix=file_name+'.', suffix='.tmp', dir=self.output_dir)
+        try:
+            with open(self.final_inp_file_path, 'r') as init_file:
+                with os.fdopen(tmp_fd, 'w') as mesh_file:
+                    # call final method
+                    self.write_input_include(init_file, mesh_file)
+            shutil.copymode(self.final_inp_file_path, tmp_path)
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def output_path(self, file_name):
+        """ resolve given output file name against output directory """
+
+        return os.path.join(self.output_dir, file_name)
 
     def __heading_section(self):
         """
@@ -426,49 +662,53 @@ class FileScanner():
         heading_string = \
             "*Heading\n** Job name: Job-1 Model name: multi_scale_rve\n" +\
                 "** Generated by: Abaqus/CAE 2017\n" +\
-                    "*Preprint, echo=NO, model=NO, history=NO, contact=NO\n" +\
-                        "**\n** PARTS\n**\n"
+                    "*Preprint, echo=NO, model=NO, history=NO, contact=NO\n"
+        # table of grain constants distribution is model data, included before parts
+        if self.distribution_materials:
+            heading_string = heading_string + \
+                "*Include, Input = {}\n".format(str(self.distribution_table_file))
+        heading_string = heading_string + "**\n** PARTS\n**\n"
         
         return heading_string
 
-    def write_input_include(self, init_lines):
+    def write_input_include(self, init_lines, mesh_file):
         """ 
             Including input files generated before, as well as 
             assembly and boundary conditions section in final 
-            input file
+            input file, given original lines and opened output file
         """
 
         # include sec file and mat file in final input file
-        tail_str_0 = "\n*Include, Input = {}\n".format(str(section_file)) +\
-            "*Include, Input = {}\n".format(str(f_pbc_file_name['X'])+".inp") +\
-                "*Include, Input = {}\n".format(str(f_pbc_file_name['Y'])+".inp") +\
-                    "*Include, Input = {}\n".format(str(f_pbc_file_name['Z'])+".inp") +\
-                        "*Include, Input = {}\n".format(str(edge_inp_file_name)+".inp") +\
-                            "*Include, Input = {}\n".format(str(corners_input_file_name)+".inp") +\
+        tail_str_0 = "\n*Include, Input = {}\n".format(str(self.section_file)) +\
+            "*Include, Input = {}\n".format(str(self.f_pbc_file_name['X'])+".inp") +\
+                "*Include, Input = {}\n".format(str(self.f_pbc_file_name['Y'])+".inp") +\
+                    "*Include, Input = {}\n".format(str(self.f_pbc_file_name['Z'])+".inp") +\
+                        "*Include, Input = {}\n".format(str(self.edge_inp_file_name)+".inp") +\
+                            "*Include, Input = {}\n".format(str(self.corners_input_file_name)+".inp") +\
                                 "*End Part\n*End Part\n"
 
-        with open(self.final_inp_file_path, 'w') as mesh_file:
-            # write heading
-            mesh_file.write(str(self.__heading_section()))
-            # loop over original lines
-            for line in init_lines:
-                if line.strip('\n') != "*End Part":
-                    mesh_file.write(line+'\n')
-            # append tail string
-            # including input files
-            mesh_file.write(tail_str_0)
-            # write assembly section
-            mesh_file.write(str(self.__assembly_section()))
-            # write material section
-            mesh_file.write(str(self.__material_section()))
-            # write boundary conditions sections
-            mesh_file.write(str(self.__bc_section(loading_condition=self.loading_condition)))
-            # write step section
-            mesh_file.write(str(self.__step_section(loading_condition=self.loading_condition)))
-            # write control section
-            mesh_file.write(str(self.__control_section(loading_condition=self.loading_condition)))
-            # write output section
-            mesh_file.write(str(self.__output_section()))
+        # write heading
+        mesh_file.write(str(self.__heading_section()))
+        # loop over original lines
+        for line in init_lines:
+            line = line.rstrip('\r\n')
+            if line != "*End Part":
+                mesh_file.write(line+'\n')
+        # append tail string
+        # including input files
+        mesh_file.write(tail_str_0)
+        # write assembly section
+        mesh_file.write(str(self.__assembly_section()))
+        # write material section
+        mesh_file.write(str(self.__material_section()))
+        # write boundary conditions sections
+        mesh_file.write(str(self.__bc_section(loading_condition=self.loading_condition)))
+        # write step section
+        mesh_file.write(str(self.__step_section(loading_condition=self.loading_condition)))
+        # write control section
+        mesh_file.write(str(self.__control_section(loading_condition=self.loading_condition)))
+        # write output section
+        mesh_file.write(str(self.__output_section()))
 
 
     def __assembly_section(self):
@@ -476,7 +716,7 @@ class FileScanner():
 
         assembly_section = \
             "**\n**\n** ASSEMBLY\n**\n*Assembly, name=Assembly\n**\n*Instance, name=TESS-1, part=TESS\n*End Instance\n" +\
-                 "**\n*Include, input={}\n".format(str(vertices_input_file_name)+".inp") +\
+                 "**\n*Include, input={}\n".format(str(self.vertices_input_file_name)+".inp") +\
                      "*End Assembly\n"
         # return string
         return assembly_section
@@ -486,7 +726,7 @@ class FileScanner():
 
         material_section = \
             "**\n**Materials\n" + \
-                "*Include, input={}\n".format(str(material_file))
+                "*Include, input={}\n".format(str(self.material_file))
         
         return material_section
 
@@ -9,7 +9,13 @@
 # @Last Modified At: 2021-03-28 17:15:05
 # @Description: Parse tess file and stelset file, generate input files.
 
-import os
+import mmap
+import re
+
+import numpy as np
+
+# section keywords of tess file, e.g. " **cell" or "  *ori"
+SECTION_RE = re.compile(rb'^[ \t]*(\*{1,3})([A-Za-z_-]+)', re.M)
 
 class GrainsParse():
     """
@@ -24,73 +30,82 @@ class GrainsParse():
         self.tess_file_path = tess_file_path
         self.stelset_file_path = stelset_file_path
         # containers
-        self.ori_dict = {}
-        self.dia_dict = {}
+        # euler angles (phi1, phi, phi2) and equivalent diameters, row i is grain i+1
+        self.ori = np.zeros((0, 3))
+        self.eqv_diam = np.zeros(0)
+        # byte offsets of tess sections, where keys are section names such as "cell"
+        # or "cell/ori", and values are (offset after keyword line, offset of next keyword)
+        self.tess_sections = None
 
-    def read_ori(self):
+    def tess_index(self):
         """
-            Parse tess file, and extract euler orientation info as dictionary
+            Scan tess file once, and index byte offsets of its sections
         """
 
-        # match strings
-        match_str = "euler-bunge"
-        stop_str = "**"
-        # read begin and stop signals
-        rd_beg = False
-        rd_stp = False
-        # open input tess file
+        if self.tess_sections is not None:
+            return self.tess_sections
+        self.tess_sections = {}
         try:
-            with open(self.tess_file_path, 'r') as tess_file:
-                # grain index
-                grain_ind = 1
-                # begin loop lines in tess file
-                for line in tess_file:
-                    line = line.rstrip()
-                    # stop loop signal
-                    if rd_stp:
-                        break
-                    # continue loop
-                    else:
-                        # read line
-                        if rd_beg:
-                            if stop_str in line:
-                                rd_stp = True
-                                continue
-                            else:
-                                # read current euler angles when signal true
-                                grain_key = str(grain_ind)
-                                angles_list = line.split()
-                                self.ori_dict[grain_key] = {"phi1":angles_list[0], "phi":angles_list[1], "phi2": angles_list[2]}
-                                # update index
-                                grain_ind = grain_ind + 1
-
-                        # match string is found, begin parse and extract
-                        elif match_str in line:
-                            rd_beg = True
-                            continue
-                        else:
-                            continue
+            with open(self.tess_file_path, 'rb') as tess_file:
+                tess_size = tess_file.seek(0, 2)
+                if tess_size == 0:
+                    return self.tess_sections
+                with mmap.mmap(tess_file.fileno(), 0, access=mmap.ACCESS_READ) as tess_map:
+                    matches = [(len(match.group(1)), match.group(2).decode(), match.start(), match.end()) \
+                        for match in SECTION_RE.finditer(tess_map)]
         except (FileNotFoundError, FileExistsError):
             print("\n\nError! No File was Found! Please Check Input Path Again!\n")
+            return self.tess_sections
+        # parent section of sub sections with single star
+        parent = ""
+        for (ind, (star_num, name, key_beg, key_end)) in enumerate(matches):
+            if star_num == 1:
+                name = parent + "/" + name
+            else:
+                parent = name
+            # section body begins after keyword and ends at next keyword
+            body_end = matches[ind+1][2] if ind+1 < len(matches) else tess_size
+            self.tess_sections[name] = (key_end, body_end)
+
+        return self.tess_sections
+
+    def read_ori(self):
+        """
+            Parse tess file, and extract euler orientation info as array
+        """
+
+        # orientation section
+        sections = self.tess_index()
+        if "cell/ori" not in sections:
+            print("\n\nError! No Orientation was Found in Tess File!\n")
+            return self.ori
+        (body_beg, body_end) = sections["cell/ori"]
+        with open(self.tess_file_path, 'rb') as tess_file:
+            tess_file.seek(body_beg)
+            body = tess_file.read(body_end - body_beg)
+        # first line of body is rest of keyword line, second one the descriptor
+        body_lines = body.split(b"\n", 2)
+        if len(body_lines) < 3 or b"euler-bunge" not in body_lines[1]:
+            print("\n\nError! Orientation in Tess File is not Euler-Bunge!\n")
+            return self.ori
+        # bulk parse euler angles
+        self.ori = np.fromstring(body_lines[2].decode(), sep=' ').reshape(-1, 3)
 
-        return self.ori_dict
+        return self.ori
 
     def read_eqvdiam(self):
         """
-            Extract Equivalent Diameter from stelset file as dictionary
+            Extract Equivalent Diameter from stelset file as array
         """
 
         try:
-            with open(self.stelset_file_path, 'r') as self.stelset_file:
-                grain_index = 1
-                for line in self.stelset_file:
-                    line = line.rstrip()
-                    self.dia_dict[str(grain_index)] = line
-                    grain_index = grain_index + 1
+            with open(self.stelset_file_path, 'r') as stelset_file:
+                # bulk parse one diameter per line
+                self.eqv_diam = np.fromstring(stelset_file.read(), sep=' ')
         except (FileExistsError, FileNotFoundError):
             print("\n\nError! No File was Found! Please Check Input Path Again!\n")
         
-        return self.dia_dict
+        return self.eqv_diam
 
 if __name__== "__main__":
 
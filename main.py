@@ -9,8 +9,14 @@
 # @Last Modified At: 2021-05-31 20:19:50
 # @Description: get input directory path in main program.
 
+import argparse
+import contextlib
+import glob
+import io
+import json
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 from file_scanner import FileScanner
 
 def bool_convert(input_char):
@@ -76,6 +82,135 @@ def standard_run():
                 print("\nWARNING!! Wrong Input!! Please check input again!!\n")
                 continue
 
+def batch_scan(dir_path, options):
+    """
+        run file scanning for one directory, return a tuple of
+        directory path, status, run time and first error message
+    """
+
+    # start time
+    start_time = time.time()
+    # collect printed messages of file scanning
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages):
+            FileScanner(dir_path, **options)
+    except Exception as exception:
+        return (dir_path, "FAILED", float(time.time() - start_time), repr(exception))
+    # end time
+    end_time = time.time()
+    # scanner reports problems by printed errors
+    error_lines = [line.strip() for line in messages.getvalue().splitlines() if "Error!" in line]
+    if len(error_lines) != 0:
+        return (dir_path, "ERROR", float(end_time - start_time), error_lines[0])
+    else:
+        return (dir_path, "OK", float(end_time - start_time), "")
+
+def batch_run(dir_patterns, options, workers=None):
+    """
+        given directories or glob patterns of RVE directories and one option set,
+        run file scanning for all directories in a process pool and print summary
+    """
+
+    # expand patterns as absolute paths
+    dir_paths = []
+    for pattern in dir_patterns:
+        for dir_path in sorted(glob.glob(os.path.expanduser(pattern))):
+            dir_path = os.path.abspath(dir_path)
+            if os.path.isdir(dir_path) and dir_path not in dir_paths:
+                dir_paths.append(dir_path)
+    if len(dir_paths) == 0:
+        print("\nError! No RVE Directory has been Found!\n")
+        return []
+
+    # share cores between scanning processes, so that node parsing of
+    # each directory does not start a pool over all cores again
+    process_num = min(workers if workers is not None else os.cpu_count(), len(dir_paths))
+    if options.get("node_workers") is None:
+        options = dict(options, node_workers=max(1, os.cpu_count() // process_num))
+    # start time
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(batch_scan, dir_paths, [options] * len(dir_paths)))
+    # end time
+    end_time = time.time()
+
+    # print summary table
+    width = max([len(dir_path) for dir_path in dir_paths] + [len("Directory")])
+    print("\n{:<{w}}  {:<6}  {:>10}  {}".format("Directory", "Status", "Time [s]", "Message", w=width))
+    print("-" * (width + 30))
+    for (dir_path, status, run_time, message) in results:
+        print("{:<{w}}  {:<6}  {:>10.2f}  {}".format(dir_path, status, run_time, message, w=width))
+    print("\nTotal Run Time: \t {} Seconds.\n".format(float(end_time - start_time)), end='\n')
+
+    return results
+
+def batch_options(args):
+    """ merge options from config file and command line flags, flags take precedence """
+
+    # default options
+    options = {"load_condition": "uni_axial", "only_graindata": False, "pbc": True, \
+        "hierarchical_ori": True, "geometric_boundary": False, "compact_pbc": False, \
+        "assignment": "greedy", "seed": None, "distribution_materials": False, \
+        "mat_bank_path": "/mnt/d/Git/rve_pbc/matbank/Bainite_1300.json", "node_workers": None}
+    dir_patterns = []
+    workers = None
+    # config file
+    if args.config is not None:
+        with open(args.config) as config_file:
+            config = json.loads(config_file.read())
+        dir_patterns = list(config.pop("dirs", []))
+        workers = config.pop("workers", None)
+        for (key, value) in config.items():
+            if key not in options:
+                raise ValueError("Unknown option '{}' in config file {}".format(key, args.config))
+            options[key] = value
+    # command line flags
+    dir_patterns = dir_patterns + list(args.dirs)
+    if args.workers is not None:
+        workers = args.workers
+    for key in options.keys():
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+    if options["load_condition"] not in ("uni_axial", "cyclic"):
+        raise ValueError("Unknown loading condition '{}'".format(options["load_condition"]))
+    if options["assignment"] not in ("greedy", "optimal"):
+        raise ValueError("Unknown assignment mode '{}'".format(options["assignment"]))
+
+    return (dir_patterns, options, workers)
+
+def arguments_parse():
+    """ parse command line arguments of batch mode """
+
+    parser = argparse.ArgumentParser(description="Generate input files of RVEs. " + \
+        "Run interactively without arguments, or process many RVE directories in batch mode.")
+    parser.add_argument("dirs", nargs='*', help="RVE directories or glob patterns, e.g. 'rves/sheet_*'")
+    parser.add_argument("--config", help="json file with 'dirs', 'workers' and scanner options")
+    parser.add_argument("--workers", type=int, help="number of processes, all cores by default")
+    parser.add_argument("--load-condition", dest="load_condition", choices=["uni_axial", "cyclic"])
+    parser.add_argument("--only-graindata", dest="only_graindata", action=argparse.BooleanOptionalAction)
+    parser.add_argument("--pbc", dest="pbc", action=argparse.BooleanOptionalAction)
+    parser.add_argument("--hierarchical-ori", dest="hierarchical_ori", action=argparse.BooleanOptionalAction)
+    parser.add_argument("--geometric-boundary", dest="geometric_boundary", action=argparse.BooleanOptionalAction)
+    parser.add_argument("--compact-pbc", dest="compact_pbc", action=argparse.BooleanOptionalAction)
+    parser.add_argument("--assignment", dest="assignment", choices=["greedy", "optimal"], \
+        help="assignment of material bank PAGs to RVE PAGs, greedy by default")
+    parser.add_argument("--distribution-materials", dest="distribution_materials", \
+        action=argparse.BooleanOptionalAction, help="one shared material with grain constants given by a distribution")
+    parser.add_argument("--node-workers", dest="node_workers", type=int, \
+        help="processes parsing large meshes of each directory, cores shared by directories by default")
+    parser.add_argument("--mat-bank", dest="mat_bank_path", \
+        help="material bank json file of hierarchical orientation, e.g. merged by merge_mtex_csv.py")
+    parser.add_argument("--seed", type=int, help="seed of random orientation extension, recorded in graindata.inp")
+
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    # call standard run
-    standard_run()
\ No newline at end of file
+    args = arguments_parse()
+    # batch run if directories are given
+    if len(args.dirs) != 0 or args.config is not None:
+        (dir_patterns, options, workers) = batch_options(args)
+        batch_run(dir_patterns, options, workers=workers)
+    else:
+        # call standard run
+        standard_run()
\ No newline at end of file
@@ -0,0 +1,126 @@
+# Copyright (c) 2021 Xiang Hu
+#
+# -*- coding:utf-8 -*-
+# @Script: merge_mtex_csv.py
+# @Author: Xiang Hu
+# @Email: xiang.hu@rwth-aachen.de
+# @Create At: 2026-10-17 21:05:12
+# @Last Modified By: Xiang Hu
+# @Last Modified At: 2026-10-17 21:05:12
+# @Description: Merge csv files exported from MTEX into one material bank with a source map.
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from read_mtex_csv import CreateHierarchOriJson, _grain_json_strs, _pag_json_block
+
+def _csv_group(csv_file_path):
+    """ parse and group one csv file, return its grouped arrays or None if it cannot be read """
+
+    hierarch = CreateHierarchOriJson(csv_file_path, None)
+    if hierarch.grain_rows is None:
+        return None
+
+    return (hierarch.pag_names, hierarch.pck_names, hierarch.pag_offsets, hierarch.pck_offsets, \
+        hierarch.ori[hierarch.grain_rows])
+
+class MergeHierarchOriJson():
+    """
+        A class for merging csv files exported from MTEX into one
+        material bank. Csv files are grouped in a process pool, PAG
+        and package ids are renumbered into disjoint ranges, and a
+        source map relating new ids to original csv file and ids
+        is saved beside the bank.
+    """
+
+    def __init__(self, csv_file_paths, mat_bank_path, workers=None):
+        """ Initialize the parameters """
+
+        # pass arguments to parameters
+        self.csv_file_paths = [os.path.abspath(csv_file_path) for csv_file_path in csv_file_paths]
+        self.mat_bank_path = os.path.abspath(mat_bank_path)
+        self.source_map_path = os.path.splitext(self.mat_bank_path)[0] + ".sources.json"
+        self.workers = workers
+        # grouped arrays of each csv file
+        self.groups = []
+        # source map, one entry per csv file
+        self.source_map = []
+
+        # auto run
+        self.__group_csv()
+        if len(self.groups) != 0:
+            self.__save_json()
+            self.__save_source_map()
+        else:
+            print("\n\nError! No CSV-Format File could be Read!\n")
+
+    def __group_csv(self):
+        """ parse and group csv files in a process pool """
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(_csv_group, self.csv_file_paths))
+        for (csv_file_path, group) in zip(self.csv_file_paths, results):
+            if group is None:
+                print("\n\nWarning! {} is Skipped, Failed to Read CSV-Format File!\n".format(csv_file_path))
+                continue
+            self.groups.append((csv_file_path, group))
+
+    def __save_json(self):
+        """
+            renumber PAGs and packages of all csv files into disjoint ranges and export
+            merged bank, same as json.dump(..., sort_keys=True, indent=4)
+        """
+
+        pag_first = 1
+        pck_first = 1
+        # merged PAGs as (new PAG name, source index, PAG index in source)
+        merged_pags = []
+        for (source_ind, (csv_file_path, group)) in enumerate(self.groups):
+            (pag_names, pck_names, pag_offsets, pck_offsets, ori) = group
+            self.source_map.append({"csv": csv_file_path, "pag_first": pag_first, "pag_num": len(pag_names), \
+                "pck_first": pck_first, "pck_num": len(pck_names), "pag_names": pag_names, "pck_names": pck_names})
+            merged_pags.extend([("PAG_" + str(pag_first + pag_ind), source_ind, pag_ind) \
+                for pag_ind in range(len(pag_names))])
+            pag_first = pag_first + len(pag_names)
+            pck_first = pck_first + len(pck_names)
+        # keys of json file are sorted as strings
+        merged_pags.sort()
+        with open(self.mat_bank_path, 'w') as output:
+            for (merged_ind, (pag_name, source_ind, pag_ind)) in enumerate(merged_pags):
+                (pag_names, pck_names, pag_offsets, pck_offsets, ori) = self.groups[source_ind][1]
+                pck_first = self.source_map[source_ind]["pck_first"]
+                pck_blocks = sorted([("PCK_" + str(pck_first + pck_ind), \
+                    _grain_json_strs(ori[pck_offsets[pck_ind]:pck_offsets[pck_ind+1]])) \
+                        for pck_ind in range(pag_offsets[pag_ind], pag_offsets[pag_ind+1])])
+                output.write(("{\n" if merged_ind == 0 else ",\n") + _pag_json_block(pag_name, pck_blocks))
+            output.write("\n}" if len(merged_pags) != 0 else "{}")
+
+    def __save_source_map(self):
+        """
+            export source map, where PAG_{pag_first+i} of merged bank is
+            pag_names[i] of csv file, and likewise for packages
+        """
+
+        with open(self.source_map_path, 'w') as output:
+            json.dump({"mat_bank": self.mat_bank_path, "sources": self.source_map}, output, indent=4)
+
+    def source_find(self, merged_pag_name):
+        """ given PAG name in merged bank, return (csv file path, original PAG name) """
+
+        pag_id = int(merged_pag_name.split("_")[-1])
+        for source in self.source_map:
+            if source["pag_first"] <= pag_id < source["pag_first"] + source["pag_num"]:
+                return (source["csv"], source["pag_names"][pag_id - source["pag_first"]])
+
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge csv files exported from MTEX into one material bank.")
+    parser.add_argument("csv_files", nargs='+', help="csv files exported from MTEX")
+    parser.add_argument("--output", required=True, help="path of merged material bank json file")
+    parser.add_argument("--workers", type=int, help="number of processes, all cores by default")
+    args = parser.parse_args()
+    merged = MergeHierarchOriJson(args.csv_files, args.output, workers=args.workers)
+    print("\nMerged {} CSV Files into {}.\n".format(len(merged.groups), merged.mat_bank_path))
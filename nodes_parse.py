@@ -9,10 +9,57 @@
 # @Last Modified At: 2021-03-17 19:25:52
 # @Description: Parse .inp file and create edges, vertices, and BCs input files.
 
+import mmap
+import multiprocessing
 import os
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.sharedctypes import RawArray
 
 import numpy as np
 
+# node blocks smaller than this size are parsed in the streaming pass
+PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+# keyword line of a nodes block, e.g. '*Node' or '*Node, nset=all'
+NODE_KEYWORD_RE = re.compile(rb'^\*node[ \t]*(,[^\n]*)?\r?$', re.IGNORECASE | re.MULTILINE)
+# any keyword or comment line, which ends the nodes block parsed in parallel,
+# node lines after a comment are left to the streaming pass
+KEYWORD_RE = re.compile(rb'^\*', re.MULTILINE)
+# shared node arrays of a worker process, set by _node_worker_init
+_shared_nodes = {}
+
+
+def _node_chunk_count(inp_path, chunk_beg, chunk_end):
+    """ count lines in given byte range of input file """
+
+    with open(inp_path, 'rb') as init_inp:
+        with mmap.mmap(init_inp.fileno(), 0, access=mmap.ACCESS_READ) as inp_map:
+            return inp_map[chunk_beg:chunk_end].count(b'\n') + 1
+
+
+def _node_worker_init(shared_labels, shared_coords):
+    """ attach shared node arrays in worker process """
+
+    _shared_nodes["labels"] = np.frombuffer(shared_labels, dtype=np.int64)
+    _shared_nodes["coords"] = np.frombuffer(shared_coords, dtype=np.float64).reshape(-1, 3)
+
+
+def _node_chunk_parse(inp_path, chunk_beg, chunk_end, row_beg):
+    """
+        parse node lines in given byte range of input file, write labels and
+        coordinates into shared arrays from row_beg on, return parsed row number
+    """
+
+    with open(inp_path, 'rb') as init_inp:
+        with mmap.mmap(init_inp.fileno(), 0, access=mmap.ACCESS_READ) as inp_map:
+            chunk = inp_map[chunk_beg:chunk_end]
+    values = np.fromstring(chunk.replace(b',', b' '), dtype=np.float64, sep=' ').reshape(-1, 4)
+    _shared_nodes["labels"][row_beg:row_beg+len(values)] = values[:, 0]
+    _shared_nodes["coords"][row_beg:row_beg+len(values)] = values[:, 1:]
+
+    return len(values)
+
 
 class NodesParse():
     """
@@ -21,22 +68,38 @@ class NodesParse():
         vertices sets, as well as boundary conditions files.
     """
 
-    def __init__(self, init_inp_path):
+    def __init__(self, init_inp_path, geometric_boundary=False, rel_tol=1e-6, workers=None):
         """ Initialize the properties"""
 
         # get input arguments
         #NOTE: get from InputFileGen().final_inp_file_path
         self.init_inp_path = init_inp_path
+        # detect face nodes by bounding box instead of named node sets
+        self.geometric_boundary = geometric_boundary
+        # tolerance relative to the bounding box size for geometric detection
+        self.rel_tol = rel_tol
+        # number of processes parsing large nodes blocks, None for all cores
+        self.workers = workers if workers is not None else os.cpu_count()
         # initialize parameters
-        self.nodes_dict = {} # store nodes information in a dictionary, in which indices are keys
-        # face sets dict
+        # node labels, node coordinates (one row per node) and label -> row index
+        self.node_labels = np.zeros(0, dtype=np.int32)
+        self.node_coords = np.zeros((0, 3), dtype=np.float64)
+        self.label_index = np.zeros(0, dtype=np.int64)
+        # face sets dict, in which sets are stored as node rows
         self.faces = {}
+        # face membership masks over all node rows, including edges and vertices
+        self.face_masks = {}
         # edge sets dict
         self.edges = {}
         # vertices dict
         self.vertices = {}
+        # all node sets and element sets in mesh, in which set names are keys
+        self.nsets = {}
+        self.elsets = {}
+        self.__mesh_scanned = False
         # auto run
         if self.__file_check():
+            self.scan_mesh()
             self.read_nodes()
             self.read_nsets()
             self.edges_find()
@@ -54,88 +117,246 @@ class NodesParse():
             print("\n\nError! Input File cannot be opened! Please Check It Again!\n")
             return False
 
-    def read_nodes(self):
-        """ parse nodes information and store them in dictionary """
-
-        # match strings
-        match_str = "*Node"
-        stop_str = "*Element, type="
-        # parse begin and stop signals
-        parse_beg = False
-        parse_stp = False
+    def scan_mesh(self):
+        """
+            parse nodes, node sets and element sets in one single pass
+            over the input file and store them in keyword-indexed containers
+        """
+
+        # large nodes block is parsed in parallel and skipped in streaming pass
+        (node_block, block_labels, block_coords) = self.__node_block_parse()
+        # node containers filled while scanning
+        labels = array('l')
+        coords = array('d')
+        # current block keyword and set name
+        crt_block = None
+        crt_name = None
+        crt_generate = False
         # open file and parse
-        with open(self.init_inp_path, 'r') as init_inp:
+        with open(self.init_inp_path, 'rb') as init_inp:
+            line_beg = 0
             # begin loop lines
-            for line in init_inp:
-                line = line.rstrip()
-                if parse_stp:
+            while True:
+                line = init_inp.readline()
+                if len(line) == 0:
                     break
-                else:
-                    # parse begin
-                    if parse_beg:
-                        if stop_str in line:
-                            parse_stp = True
+                # jump over nodes block parsed before
+                if node_block is not None and line_beg == node_block[0]:
+                    crt_block = "*node"
+                    init_inp.seek(node_block[2])
+                    line_beg = node_block[2]
+                    continue
+                line_beg = line_beg + len(line)
+                line = line.decode().strip()
+                # an empty line closes the current block
+                if len(line) == 0:
+                    crt_block = None
+                    continue
+                # comment line
+                elif line.startswith('**'):
+                    continue
+                # keyword line opens a new block
+                elif line.startswith('*'):
+                    (crt_block, crt_name, crt_generate) = self.__keyword_parse(line)
+                    continue
+                # data line of nodes block
+                elif crt_block == "*node":
+                    line_list = line.split(',')
+                    if len(line_list) >= 4:
+                        labels.append(int(line_list[0]))
+                        coords.extend((float(line_list[1]), float(line_list[2]), float(line_list[3])))
+                # data line of node set or element set block
+                elif crt_block == "*nset" or crt_block == "*elset":
+                    set_dict = self.nsets if crt_block == "*nset" else self.elsets
+                    line_list = []
+                    for item in line.split(','):
+                        item = item.strip()
+                        if item == '':
                             continue
+                        # members given by name of a set parsed before, unknown names are skipped
+                        elif not item.lstrip('-').isdigit():
+                            line_list.extend(set_dict.get(item, []))
                         else:
-                            line_list = list(line.split(', '))
-                            if len(line_list) != 1:
-                                self.nodes_dict[str(line_list[0])] = {"x": float(line_list[1]), \
-                                    "y": float(line_list[2]), "z": float(line_list[3])}
-                    elif match_str in line:
-                        parse_beg = True
-                        continue
-                    else:
-                        continue
+                            line_list.append(int(item))
+                    if crt_generate:
+                        (first, last, step) = (line_list + [1])[:3]
+                        line_list = range(first, last+1, step)
+                    set_dict[crt_name].extend(line_list)
+                else:
+                    continue
 
-    def __nset_extract(self, nset_dict, set_name):
-        """ given a empty set list and the set name, then extract nodes set as list """ 
+        # store nodes as compact arrays
+        self.node_labels = np.concatenate((block_labels, \
+            np.frombuffer(labels, dtype=labels.typecode))).astype(np.int32)
+        self.node_coords = np.concatenate((block_coords, \
+            np.frombuffer(coords, dtype=np.float64).reshape(-1, 3)))
+        self.__label_index_build()
+        # store sets as label arrays
+        for set_dict in (self.nsets, self.elsets):
+            for (set_name, set_list) in set_dict.items():
+                set_dict[set_name] = np.frombuffer(set_list, dtype=set_list.typecode).astype(np.int64)
 
-        # match strings
-        match_str = "*Nset, nset=" + str(set_name)
-        # set list
-        set_list = []
-        # parse begin and stop signals
-        parse_beg = False
-        parse_stp = False
-        # open file and parse
-        with open(self.init_inp_path, 'r') as init_inp:
-            # begin loop lines
-            for line in init_inp:
-                line = line.rstrip()
-                if parse_stp:
-                    break
-                else:
-                    # parse begin
-                    if parse_beg:
-                        if len(line) == 0:
-                            parse_stp = True
-                            continue
-                        else:
-                            line_list = list(line.split(' '))
-                            line_list = [node.replace(',', '') for node in line_list]
-                            if len(line_list) != 0 and line_list[0] != '':
-                                set_list.extend(line_list)
-                    elif match_str in line:
-                        parse_beg = True
-                        continue
-                    else:
-                        continue
-        
-        # store the set list into faces dict
-        nset_dict[set_name] = set_list
+        self.__mesh_scanned = True
+
+    def __label_index_build(self):
+        """ build a dense lookup array which maps node label to node row """
+
+        max_label = int(self.node_labels.max()) if len(self.node_labels) != 0 else -1
+        self.label_index = np.full(max_label+1, -1, dtype=np.int64)
+        self.label_index[self.node_labels] = np.arange(len(self.node_labels))
+
+    def label_to_row(self, label_set):
+        """ given node labels, return the node rows, unknown labels are dropped """
+
+        label_set = np.asarray(label_set, dtype=np.int64)
+        label_set = label_set[(label_set >= 0) & (label_set < len(self.label_index))]
+        rows = self.label_index[label_set]
+
+        return rows[rows >= 0]
+
+    def row_to_label(self, row_set):
+        """ given node rows, return the node labels """
+
+        return self.node_labels[np.asarray(row_set, dtype=np.int64)]
+
+    def __node_block_parse(self):
+        """
+            memory-map input file and locate the first nodes block, if it is large,
+            split it on line boundaries and parse the chunks in a process pool into
+            shared arrays. Return (keyword line begin, data begin, data end) of the
+            block or None, as well as labels and coordinates parsed.
+        """
+
+        no_block = (None, np.zeros(0, dtype=np.int64), np.zeros((0, 3), dtype=np.float64))
+        if self.workers is None or self.workers <= 1 or os.path.getsize(self.init_inp_path) < PARALLEL_MIN_BYTES:
+            return no_block
+        # locate nodes block
+        with open(self.init_inp_path, 'rb') as init_inp:
+            with mmap.mmap(init_inp.fileno(), 0, access=mmap.ACCESS_READ) as inp_map:
+                keyword_match = NODE_KEYWORD_RE.search(inp_map)
+                if keyword_match is None:
+                    return no_block
+                data_beg = min(keyword_match.end() + 1, len(inp_map))
+                next_match = KEYWORD_RE.search(inp_map, data_beg)
+                data_end = next_match.start() if next_match is not None else len(inp_map)
+                if data_end - data_beg < PARALLEL_MIN_BYTES:
+                    return no_block
+                # chunk bounds on line boundaries
+                chunk_size = (data_end - data_beg) // self.workers + 1
+                chunk_bounds = [data_beg]
+                while chunk_bounds[-1] < data_end:
+                    line_end = inp_map.find(b'\n', min(chunk_bounds[-1] + chunk_size, data_end - 1), data_end)
+                    chunk_bounds.append(data_end if line_end < 0 else line_end + 1)
+        chunks = list(zip(chunk_bounds[:-1], chunk_bounds[1:]))
+        inp_paths = [self.init_inp_path] * len(chunks)
+        # nodes may be parsed from a stage thread of FileScanner, so workers
+        # are started by a forkserver instead of forking a multi-threaded process
+        mp_context = multiprocessing.get_context("forkserver")
+        # rows capacity of each chunk
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context) as executor:
+            row_caps = list(executor.map(_node_chunk_count, inp_paths, *zip(*chunks)))
+        row_begs = np.concatenate(([0], np.cumsum(row_caps))).astype(np.int64)
+        row_cap = int(row_begs[-1])
+        # shared arrays which workers parse into
+        shared_labels = RawArray('q', row_cap)
+        shared_coords = RawArray('d', row_cap*3)
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context, initializer=_node_worker_init, \
+            initargs=(shared_labels, shared_coords)) as executor:
+            row_nums = list(executor.map(_node_chunk_parse, inp_paths, *zip(*chunks), row_begs[:-1].tolist()))
+        labels = np.frombuffer(shared_labels, dtype=np.int64)
+        coords = np.frombuffer(shared_coords, dtype=np.float64).reshape(-1, 3)
+        # gather parsed rows of all chunks
+        block_labels = np.concatenate([labels[beg:beg+num] for (beg, num) in zip(row_begs, row_nums)])
+        block_coords = np.concatenate([coords[beg:beg+num] for (beg, num) in zip(row_begs, row_nums)])
+
+        return ((keyword_match.start(), data_beg, data_end), block_labels, block_coords)
+
+    def __keyword_parse(self, line):
+        """ given a keyword line, return block keyword, set name and generate signal """
+
+        params = [param.strip() for param in line.split(',')]
+        keyword = params[0].lower()
+        set_name = None
+        generate = False
+        for param in params[1:]:
+            (param_key, sep, param_value) = param.partition('=')
+            param_key = param_key.strip().lower()
+            if keyword == "*nset" and param_key == "nset":
+                set_name = param_value.strip()
+            elif keyword == "*elset" and param_key == "elset":
+                set_name = param_value.strip()
+            elif param_key == "generate":
+                generate = True
+        # create container for a new set, sets with same name are merged
+        if keyword == "*nset" and set_name is not None:
+            self.nsets.setdefault(set_name, array('l'))
+        elif keyword == "*elset" and set_name is not None:
+            self.elsets.setdefault(set_name, array('l'))
+        elif keyword != "*node":
+            keyword = None
+
+        return (keyword, set_name, generate)
+
+    def read_nodes(self):
+        """ parse nodes information and store labels and coordinates in node_labels and node_coords """
+
+        if not self.__mesh_scanned:
+            self.scan_mesh()
 
     def read_nsets(self):
-        """ parse nodes sets information and store them in lists """
+        """ parse nodes sets information and store face sets as node rows in faces """
 
+        if not self.__mesh_scanned:
+            self.scan_mesh()
         faces = self.__3d_cubic_faces()
+        # fall back to geometric detection if any face set is missing
+        if not self.geometric_boundary:
+            for face in faces:
+                if len(self.nsets.get(face, [])) == 0:
+                    print("\nWarning! Face Node Set {} cannot be Found! Boundary Nodes are Detected by Geometry.\n".format(face))
+                    self.geometric_boundary = True
+                    break
+        if self.geometric_boundary:
+            self.__geometric_faces_find()
+        else:
+            for face in faces:
+                self.faces[face] = self.label_to_row(self.nsets[face])
+        self.__face_masks_build()
+
+    def __geometric_faces_find(self):
+        """ find face nodes sets on the bounding box of all nodes within relative tolerance """
+
+        faces = self.__3d_cubic_faces()
+        if len(self.node_labels) == 0:
+            for face in faces:
+                self.faces[face] = np.zeros(0, dtype=np.int64)
+            return
+        # bounding box
+        box_min = self.node_coords.min(axis=0)
+        box_max = self.node_coords.max(axis=0)
+        abs_tol = self.__abs_tol()
+        # nodes on lower and upper planes of each axis
         for face in faces:
-            self.__nset_extract(self.faces, set_name=face)
+            axis_ind = "xyz".index(face[0])
+            plane = box_min[axis_ind] if face[1] == '0' else box_max[axis_ind]
+            self.faces[face] = np.flatnonzero(np.abs(self.node_coords[:, axis_ind] - plane) <= abs_tol)
+
+    def __face_masks_build(self):
+        """ build boolean membership mask over all node rows for every face set """
+
+        for (face_name, face_set) in self.faces.items():
+            face_mask = np.zeros(len(self.node_labels), dtype=bool)
+            face_mask[face_set] = True
+            self.face_masks[face_name] = face_mask
 
-    def __intersection(self, set_1, set_2):
-        """ find the intersection of two set and extract the intersection """
+    def __rows_mask(self, row_sets):
+        """ given node row sets, return the boolean mask of their union """
 
-        inter_ls = np.intersect1d(set_1, set_2).tolist()
-        return inter_ls
+        union_mask = np.zeros(len(self.node_labels), dtype=bool)
+        for row_set in row_sets:
+            union_mask[row_set] = True
+
+        return union_mask
 
     def __3d_cubic_faces(self):
         """ stack 6 faces name in a list and return the list """
@@ -198,7 +419,7 @@ class NodesParse():
         edges = self.__3d_cubic_edges(cubic_faces=faces)
         for edge in edges:
             (f_1, f_2) = edge.split('-')
-            self.edges[edge] = self.__intersection(self.faces[f_1], self.faces[f_2])
+            self.edges[edge] = np.flatnonzero(self.face_masks[f_1] & self.face_masks[f_2])
 
     def vertices_find(self):
         """ find and define vertices nodes """
@@ -235,49 +456,31 @@ class NodesParse():
                     vertice = pre_char + str(post_num)
                     # intersection point find
                     if post_num != 5:
-                        self.vertices[vertice] = self.__intersection(self.__intersection(\
-                            self.faces['z'+str(z_ind)], self.faces['x'+str(x_ind)]), \
-                            self.faces['y'+str(y_ind)])
+                        self.vertices[vertice] = np.flatnonzero(self.face_masks['z'+str(z_ind)] & \
+                            self.face_masks['x'+str(x_ind)] & self.face_masks['y'+str(y_ind)])
                     else:
                         break
 
-    def __inter_rm(self, set_1, set_2):
-        """ 
-            Given set_1 as a subset of set 2, 
-            and remove all elements which in set_1 from set_2
-        """
-
-        # if set_1 is a subset of set_2
-        inter_list = self.__intersection(set_1, set_2)
-        
-        for item in inter_list:
-            # remove item in subset
-            set_2.remove(item)
-        # return set_2
-        return set_2
-
     def internodes_remove(self):
         """ remove edge nodes from faces, and vertice nodes from edges """
 
         # remove edge nodes from face nodes
-        for (edge_name, edge_set) in self.edges.items():
-            for face_name in edge_name.split('-'):
-                self.faces[face_name] = self.__inter_rm(edge_set, self.faces[face_name])
+        for face_name in list(self.faces.keys()):
+            face_edges = [edge_set for (edge_name, edge_set) in self.edges.items() \
+                if face_name in edge_name.split('-')]
+            self.faces[face_name] = np.flatnonzero(self.face_masks[face_name] & ~self.__rows_mask(face_edges))
         # remove vertice nodes from edge nodes
-        for (vertice_name, vertice_node) in self.vertices.items():
-            for (edge_name, edge_set) in self.edges.items():
-                self.edges[edge_name] = self.__inter_rm(vertice_node, edge_set)
+        vertices_mask = self.__rows_mask(self.vertices.values())
+        for (edge_name, edge_set) in self.edges.items():
+            self.edges[edge_name] = edge_set[~vertices_mask[edge_set]]
 
     def __set_sort(self, set):
-        """ Given set and sort it by coordinates from nodes dictionary """
+        """ Given set of node rows and sort it by coordinates (x, y, z) """
 
-        # get nodes information
-        node_info = {}
-        for node_ind in set:
-            node_info[node_ind] = self.nodes_dict[node_ind]
-        # sort keys by coordinates
-        sorted_set = sorted(node_info, key=lambda node_ind: (node_info[node_ind]['x'],\
-            node_info[node_ind]['y'], node_info[node_ind]['z']))
+        # get nodes coordinates
+        set_coords = self.node_coords[set]
+        # sort rows by coordinates, x is the primary key
+        sorted_set = set[np.lexsort((set_coords[:, 2], set_coords[:, 1], set_coords[:, 0]))]
 
         return sorted_set
     
@@ -291,6 +494,65 @@ class NodesParse():
         for (edge_name, e_node_set) in self.edges.items():
             self.edges[edge_name] = self.__set_sort(e_node_set)
 
+    def periodic_pair(self, set_name_p, set_name_n):
+        """
+            Given names of two periodic face or edge sets, pair nodes by their
+            clustered tangential coordinates and return the partner rows in
+            set_n aligned with the rows in set_p, None if sets do not match.
+        """
+
+        node_sets = self.faces if set_name_p in self.faces else self.edges
+        set_p = node_sets[set_name_p]
+        set_n = node_sets[set_name_n]
+        if len(set_p) != len(set_n):
+            print("\nError! Node Sets {} and {} have Different Sizes!\n".format(set_name_p, set_name_n))
+            return None
+        # tangential axes are the ones not fixed by the set names
+        fixed_axes = set(face_name[0] for face_name in (set_name_p + '-' + set_name_n).split('-'))
+        tang_axes = [axis_ind for axis_ind in range(3) if "xyz"[axis_ind] not in fixed_axes]
+        # cluster tangential coordinates of both sets by the absolute tolerance
+        abs_tol = self.__abs_tol()
+        coords_p = self.node_coords[set_p][:, tang_axes]
+        coords_n = self.node_coords[set_n][:, tang_axes]
+        (keys_p, keys_n) = self.__cluster_keys(coords_p, coords_n, abs_tol)
+        # merge sets sorted by cluster keys, first tangential axis is the primary key
+        order_p = np.lexsort(keys_p.T[::-1])
+        order_n = np.lexsort(keys_n.T[::-1])
+        if np.any(np.abs(coords_p[order_p] - coords_n[order_n]) > abs_tol):
+            print("\nError! Nodes in Sets {} and {} are not Periodic!\n".format(set_name_p, set_name_n))
+            return None
+        # partner of each node in set_p
+        partner = np.empty_like(set_n)
+        partner[order_p] = set_n[order_n]
+
+        return partner
+
+    def __cluster_keys(self, coords_p, coords_n, abs_tol):
+        """
+            Given tangential coordinates of two sets, return integer keys of both
+            sets, where coordinates on one axis share a key if they are chained by
+            gaps within absolute tolerance, so that close coordinates never get
+            different keys as they do by rounding.
+        """
+
+        coords = np.vstack((coords_p, coords_n))
+        keys = np.empty(coords.shape, dtype=np.int64)
+        for axis_ind in range(coords.shape[1]):
+            order = np.argsort(coords[:, axis_ind], kind="stable")
+            # a new cluster starts wherever the gap to the previous coordinate exceeds tolerance
+            keys[order, axis_ind] = np.concatenate(([0], np.cumsum(np.diff(coords[order, axis_ind]) > abs_tol)))
+
+        return (keys[:len(coords_p)], keys[len(coords_p):])
+
+    def __abs_tol(self):
+        """ return absolute tolerance from relative tolerance and bounding box size """
+
+        if len(self.node_labels) == 0:
+            return self.rel_tol
+        box_span = float((self.node_coords.max(axis=0) - self.node_coords.min(axis=0)).max())
+
+        return self.rel_tol * box_span if box_span > 0 else self.rel_tol
+
 if __name__== "__main__":
 
     input_path = "/mnt/d/User_Hu_Xiang/Neper/Trial/cae/python_files/multi_scale_01/multi_scale_01.inp"
@@ -11,6 +11,8 @@
 
 import json
 
+import numpy as np
+
 class HierarchicalRead():
     """
         A class for read .stcell file generated from Neper,
@@ -26,57 +28,55 @@ class HierarchicalRead():
         self.stcell_file = stcell_file_path
         # container
         self.hierarchical_dict = {}
+        # CSR-style hierarchy, in order of runs in .stcell file
+        # PAG id of each PAG
+        self.pag_ids = np.zeros(0, dtype=np.int64)
+        # packages of PAG a are pag_offsets[a]:pag_offsets[a+1]
+        self.pag_offsets = np.zeros(1, dtype=np.int64)
+        # lines of package p are pck_offsets[p]:pck_offsets[p+1]
+        self.pck_offsets = np.zeros(1, dtype=np.int64)
+        # grain number of each package, which is grain id on its last line
+        self.grain_counts = np.zeros(0, dtype=np.int64)
+
+    def read_hierarch_csr(self):
+        """
+            Load .stcell file as integer (PAG, package, grain) array in bulk, and find
+            boundaries of PAGs and packages, return (pag_ids, pag_offsets, pck_offsets, grain_counts)
+        """
 
-    def read_hierarch(self):
-        """ Parse .stcell file, and extract hierarchical information as a dictionary """
-        
         # open .stcell file
         try:
             with open(self.stcell_file, 'r') as stcell_file:
-                # previous parameters
-                pre_pag_ind = None
-                pre_pck_ind = None
-                pre_bnt_ind = None
-                # loop over lines
-                for line in stcell_file:
-                    line = line.rstrip()
-                    line_list = line.split()
-                    # if empty line
-                    if len(line_list) == 0:
-                        continue
-                    # otherwise
-                    else:
-                        # current parameters
-                        crt_pag_ind = line_list[0]
-                        crt_pck_ind = line_list[1]
-                        crt_bnt_ind = line_list[2]
-
-                        # if new pag
-                        if crt_pag_ind != pre_pag_ind:
-                            # create empty list
-                            self.hierarchical_dict["PAG_"+str(crt_pag_ind)] = []
-                            # if not first run
-                            if pre_pck_ind != None:
-                                # append max. grain number as element in list to pag
-                                self.hierarchical_dict["PAG_"+str(pre_pag_ind)].append(int(pre_bnt_ind))
-                            else:
-                                pass
-                        # otherwise
-                        else:
-                            if crt_pck_ind != pre_pck_ind:
-                                # append max. grain number as element in list to pag
-                                self.hierarchical_dict["PAG_"+str(pre_pag_ind)].append(int(pre_bnt_ind))
-                            else:
-                                pass
-                        # pass current to previous
-                        pre_pag_ind = crt_pag_ind
-                        pre_pck_ind = crt_pck_ind
-                        pre_bnt_ind = crt_bnt_ind
-                # add the last line information to hierarch dict
-                self.hierarchical_dict["PAG_"+str(pre_pag_ind)].append(int(pre_bnt_ind))
+                ids = np.fromstring(stcell_file.read(), dtype=np.int64, sep=' ')
         # if Error
-        except FileExistsError or FileNotFoundError:
+        except (FileExistsError, FileNotFoundError):
             print("\n\nError! No .Stcell File was Found! Please Check Input Path Again!\n")
+            return (self.pag_ids, self.pag_offsets, self.pck_offsets, self.grain_counts)
+        if len(ids) % 3 != 0:
+            print("\n\nError! Each Line of .Stcell File should Contain PAG, Package and Grain Ids!\n")
+            return (self.pag_ids, self.pag_offsets, self.pck_offsets, self.grain_counts)
+        ids = ids.reshape(-1, 3)
+        # a new PAG begins where PAG id changes, a new package where PAG id or package id changes
+        pag_change = np.concatenate(([len(ids) != 0], np.diff(ids[:, 0]) != 0))
+        pck_change = pag_change | np.concatenate(([len(ids) != 0], np.diff(ids[:, 1]) != 0))
+        pck_begs = np.flatnonzero(pck_change)
+        self.pck_offsets = np.append(pck_begs, len(ids))
+        self.grain_counts = ids[self.pck_offsets[1:] - 1, 2]
+        # package index of first package in each PAG
+        self.pag_offsets = np.append(np.flatnonzero(pag_change[pck_begs]), len(pck_begs))
+        self.pag_ids = ids[pck_begs[self.pag_offsets[:-1]], 0]
+
+        return (self.pag_ids, self.pag_offsets, self.pck_offsets, self.grain_counts)
+
+    def read_hierarch(self):
+        """ Parse .stcell file, and extract hierarchical information as a dictionary """
+        
+        (pag_ids, pag_offsets, pck_offsets, grain_counts) = self.read_hierarch_csr()
+        # a PAG id appearing again starts its list again
+        pag_offsets = pag_offsets.tolist()
+        grain_counts = grain_counts.tolist()
+        for (pag_ind, pag_id) in enumerate(pag_ids.tolist()):
+            self.hierarchical_dict["PAG_"+str(pag_id)] = grain_counts[pag_offsets[pag_ind]:pag_offsets[pag_ind+1]]
 
         # return dict
         return self.hierarchical_dict
@@ -9,9 +9,44 @@
 # @Last Modified At: 2021-03-29 11:38:22
 # @Description: Read csv file exported from MTEX and save hierarchical information as json file.
 
+import heapq
+import itertools
 import os
-import csv
 import json
+import tempfile
+
+import numpy as np
+
+# indentation of json file, same as json.dump(..., indent=4)
+JSON_INDENT = "    "
+# orientation of single grain, keys in sorted order
+GRAIN_TEMPLATE = JSON_INDENT * 3 + "{{\n" + \
+    JSON_INDENT * 4 + "\"phi\": {1},\n" + \
+        JSON_INDENT * 4 + "\"phi1\": {0},\n" + \
+            JSON_INDENT * 4 + "\"phi2\": {2}\n" + JSON_INDENT * 3 + "}}"
+
+# estimated peak memory per csv row while parsing and sorting a chunk, in bytes
+ROW_BYTES = 512
+
+def _grain_json_strs(ori_values):
+    """ given orientation rows (phi1, phi, phi2), return json strings of grains """
+
+    ori_values = np.asarray(ori_values, dtype=np.float64).ravel()
+    # float format of json
+    ori_strs = list(map(float.__repr__, ori_values.tolist()))
+    for ind in np.flatnonzero(~np.isfinite(ori_values)).tolist():
+        ori_strs[ind] = json.dumps(float(ori_values[ind]))
+
+    return list(map(GRAIN_TEMPLATE.format, ori_strs[0::3], ori_strs[1::3], ori_strs[2::3]))
+
+def _pag_json_block(pag_name, pck_blocks):
+    """ given PAG name and list of (package name, grain json strings), return json string of PAG """
+
+    pck_strs = [JSON_INDENT * 2 + json.dumps(pck_name) + ": [\n" + ",\n".join(grain_strs) + \
+        "\n" + JSON_INDENT * 2 + "]" for (pck_name, grain_strs) in pck_blocks]
+    pck_block = "{\n" + ",\n".join(pck_strs) + "\n" + JSON_INDENT + "}" if len(pck_strs) != 0 else "{}"
+
+    return JSON_INDENT + json.dumps(pag_name) + ": " + pck_block
 
 class CreateHierarchOriJson():
     """
@@ -21,110 +56,227 @@ class CreateHierarchOriJson():
         json file.
     """
 
-    def __init__(self, csv_file_path, mat_name):
+    def __init__(self, csv_file_path, mat_name, memory_budget=None):
         """ Initialize the parameters """
 
         # pass arguments to parameters
         self.csv_file_path = csv_file_path
         self.mat_name = mat_name
-        # initialize a empty dictionary 
-        self.info_dict = {}
-        # initialize a empty list to store lines
-        self.lines = []
+        # memory budget in bytes, if given csv file is read in chunks,
+        # which are spilled to disk as sorted runs and merged into bank
+        self.memory_budget = memory_budget
+        # columns of csv file, PAG and package ids are kept as read
+        self.pag_ids = None
+        self.pck_ids = None
+        self.ori = None
+        # grouped arrays, in sorted order of PAG and package names
+        # rows of grains grouped by package
+        self.grain_rows = None
+        # grains of package p are grain_rows[pck_offsets[p]:pck_offsets[p+1]]
+        self.pck_offsets = None
+        # packages of PAG a are pag_offsets[a]:pag_offsets[a+1]
+        self.pag_offsets = None
+        # names of kept PAGs and packages
+        self.pag_names = []
+        self.pck_names = []
         # initialize file path and file name
         self.dir_path = None
         self.csv_file = None
 
         # auto run
-        if self.check():
-            self.__write_dict()
-            self.__pop_items()
-            self.__save_json()
+        if self.memory_budget is not None:
+            if not self.__stream_build():
+                print("\n\nError! Failed to Read CSV-Format file! Please Check File Again!\n")
+        elif self.check():
+            self.__group_rows()
+            # rows are only grouped if no bank name is given
+            if self.mat_name is not None:
+                self.__save_json()
         else:
             print("\n\nError! Failed to Read CSV-Format file! Please Check File Again!\n")
 
     def check(self):
-        """ Check if file path is valid and file is openable. """
+        """ Check if file path is valid and file is openable, and read columns in bulk. """
 
         # split path and file name
         (self.dir_path, self.csv_file) = os.path.split(self.csv_file_path)
         
         # try open
         try:
-            # change working directory
-            os.chdir(self.dir_path)
             # if file is a csv file
             (file_name, extension) = os.path.splitext(self.csv_file)
-            if extension == ".csv":
-                with open(self.csv_file, 'r') as csv_file:
-                    # begin loop lines
-                    for line in csv_file:
-                        # append to lines list
-                        self.lines.append(line.rsplit())
-            # if more than one line was read
-            if len(self.lines) > 1:
-                return True
-            else:
+            if extension != ".csv":
                 return False
-        except FileNotFoundError or FileExistsError:
+            with open(self.csv_file_path, 'r') as csv_file:
+                # first field of each line, which holds comma separated values
+                lines = [line_fields[0] for line_fields in map(str.split, csv_file.read().splitlines()) \
+                    if len(line_fields) != 0]
+        except (FileNotFoundError, FileExistsError):
             return False
+        # if more than one line was read
+        if len(lines) <= 1:
+            return False
+        columns = self.__columns_parse(lines)
+        if columns is None:
+            return False
+        (self.pag_ids, self.pck_ids, self.ori) = columns
+
+        return True
+
+    def __columns_parse(self, lines):
+        """ given csv lines, return columns of PAG ids, package ids and orientations """
+
+        # columns: grain index, PAG id, package id, phi1, Phi, phi2
+        cells = ",".join(lines).split(',')
+        if len(cells) != 6 * len(lines):
+            print("\n\nError! Each Line of CSV File should Contain 6 Values!\n")
+            return None
+        pag_ids = np.array(cells[1::6])
+        pck_ids = np.array(cells[2::6])
+        ori = np.column_stack([np.fromstring(",".join(cells[col::6]), sep=',') for col in (3, 4, 5)])
 
-    def __write_dict(self):
-        """ write information stored in list into dictionary """
-
-        for line in self.lines:
-            # split line
-            info_list = line[0].split(',')
-            # info
-            grain_ind = info_list[0]
-            crt_pag_id = "PAG_" + str(info_list[1])
-            crt_pck_id = "PCK_" + str(info_list[2])
-            phi_1 = float(info_list[3])
-            Phi = float(info_list[4])
-            phi_2 = float(info_list[5])
-            # create a empty dict to store orientation info of single grain
-            grain_ori_dict = {"phi1": phi_1, "phi": Phi, "phi2": phi_2}
-            # if PAG index already in info dict
-            if crt_pag_id in self.info_dict:
-                #if PCK index already in PAG dict
-                if crt_pck_id in self.info_dict[crt_pag_id]:
-                    # pass
-                    pass
-                # otherwise
-                else:
-                    self.info_dict[crt_pag_id][crt_pck_id] = []
-                    
-            # otherwise
-            else:
-                # create PAG dict
-                self.info_dict[crt_pag_id] = {}
-                # create PCK dict
-                self.info_dict[crt_pag_id][crt_pck_id] = []
-
-            self.info_dict[crt_pag_id][crt_pck_id].append(grain_ori_dict)
-
-    def __pop_items(self):
+        return (pag_ids, pck_ids, ori.reshape(-1, 3))
+
+    def __group_rows(self):
         """
-            delete the items, which contain only one single PCK dict
-            or delete its PCK dict, which contain one single grain
+            group rows by PAG and package in sorted order of their names, and
+            delete PAGs which contain only one single package, as well as
+            packages which contain one single grain
         """
 
-        for pag_name in list(self.info_dict.keys()):
-            if len(self.info_dict[pag_name].keys()) <= 1:
-                self.info_dict.pop(pag_name)
-            else:
-                for pck_name in list(self.info_dict[pag_name].keys()):
-                    if len(self.info_dict[pag_name][pck_name]) <= 1:
-                        self.info_dict[pag_name].pop(pck_name)
-
+        # stable sort keeps order of grains in csv file within each package
+        order = np.lexsort((self.pck_ids, self.pag_ids))
+        pag_ids = self.pag_ids[order]
+        pck_ids = self.pck_ids[order]
+        # first row of each package and each PAG
+        pag_change = np.concatenate(([True], pag_ids[1:] != pag_ids[:-1]))
+        pck_change = pag_change | np.concatenate(([True], pck_ids[1:] != pck_ids[:-1]))
+        pck_begs = np.flatnonzero(pck_change)
+        pck_sizes = np.diff(np.append(pck_begs, len(order)))
+        # PAG of each package, and package number of each PAG counted before filtering grains
+        pck_pag = np.cumsum(pag_change)[pck_begs] - 1
+        pag_pck_num = np.bincount(pck_pag)
+        pag_keep = pag_pck_num > 1
+        pck_keep = pag_keep[pck_pag] & (pck_sizes > 1)
+        # kept packages and grains
+        kept_pcks = np.flatnonzero(pck_keep)
+        grain_keep = np.repeat(pck_keep, pck_sizes)
+        self.grain_rows = order[grain_keep]
+        self.pck_offsets = np.concatenate(([0], np.cumsum(pck_sizes[kept_pcks])))
+        # kept PAGs, which may end up without packages
+        kept_pags = np.flatnonzero(pag_keep)
+        self.pag_offsets = np.searchsorted(pck_pag[kept_pcks], np.append(kept_pags, len(pag_pck_num)))
+        self.pag_names = ["PAG_" + str(pag_id) for pag_id in pag_ids[np.flatnonzero(pag_change)[kept_pags]]]
+        self.pck_names = ["PCK_" + str(pck_id) for pck_id in pck_ids[pck_begs[kept_pcks]]]
 
     def __save_json(self):
-        """ export dictionary as json file """
+        """ export grouped arrays as json file, same as json.dump(..., sort_keys=True, indent=4) """
+
+        filename = str(self.mat_name)
+        output_path = os.path.join(self.dir_path, filename)
+        grain_strs = _grain_json_strs(self.ori[self.grain_rows])
+        # PAG blocks
+        pag_strs = []
+        pag_offsets = self.pag_offsets.tolist()
+        pck_offsets = self.pck_offsets.tolist()
+        for (pag_ind, pag_name) in enumerate(self.pag_names):
+            pck_blocks = [(self.pck_names[pck_ind], grain_strs[pck_offsets[pck_ind]:pck_offsets[pck_ind+1]]) \
+                for pck_ind in range(pag_offsets[pag_ind], pag_offsets[pag_ind+1])]
+            pag_strs.append(_pag_json_block(pag_name, pck_blocks))
+        with open(output_path, 'w') as output:
+            output.write("{\n" + ",\n".join(pag_strs) + "\n}" if len(pag_strs) != 0 else "{}")
+
+    def __stream_build(self):
+        """
+            read csv file in chunks bounded by memory budget, spill each chunk
+            as a run sorted by PAG id, package id and row to disk, and merge
+            the runs into bank while writing it PAG by PAG
+        """
+
+        (self.dir_path, self.csv_file) = os.path.split(self.csv_file_path)
+        (file_name, extension) = os.path.splitext(self.csv_file)
+        if extension != ".csv":
+            return False
+        chunk_rows = max(1, self.memory_budget // ROW_BYTES)
+        with tempfile.TemporaryDirectory(prefix="bank_runs_") as run_dir:
+            run_paths = []
+            row_num = 0
+            try:
+                with open(self.csv_file_path, 'r') as csv_file:
+                    while True:
+                        raw_lines = list(itertools.islice(csv_file, chunk_rows))
+                        if len(raw_lines) == 0:
+                            break
+                        lines = [line_fields[0] for line_fields in map(str.split, raw_lines) if len(line_fields) != 0]
+                        if len(lines) == 0:
+                            continue
+                        columns = self.__columns_parse(lines)
+                        if columns is None:
+                            return False
+                        run_paths.append(self.__run_spill(run_dir, len(run_paths), row_num, columns))
+                        row_num = row_num + len(lines)
+            except (FileNotFoundError, FileExistsError):
+                return False
+            # if more than one line was read
+            if row_num <= 1:
+                return False
+            # runs are read in blocks which share the memory budget
+            block_rows = max(1, self.memory_budget // (ROW_BYTES * len(run_paths)))
+            merged_records = heapq.merge(*[self.__run_records(run_path, block_rows) for run_path in run_paths])
+            self.__stream_save_json(merged_records)
+
+        return True
+
+    def __run_spill(self, run_dir, run_ind, row_beg, columns):
+        """ save parsed chunk as a run sorted by PAG id, package id and row, return its path """
+
+        (pag_ids, pck_ids, ori) = columns
+        # ids as utf-8 bytes, whose order is same as order of strings
+        pag_ids = np.char.encode(pag_ids, 'utf-8')
+        pck_ids = np.char.encode(pck_ids, 'utf-8')
+        run = np.zeros(len(pag_ids), dtype=[("pag", pag_ids.dtype), ("pck", pck_ids.dtype), \
+            ("row", np.int64), ("ori", np.float64, 3)])
+        run["pag"] = pag_ids
+        run["pck"] = pck_ids
+        run["row"] = np.arange(row_beg, row_beg + len(pag_ids))
+        run["ori"] = ori
+        run = run[np.lexsort((run["row"], pck_ids, pag_ids))]
+        run_path = os.path.join(run_dir, "run_{}.npy".format(run_ind))
+        np.save(run_path, run)
+
+        return run_path
+
+    def __run_records(self, run_path, block_rows):
+        """ yield records (PAG id, package id, row, orientation) of a run, reading it block by block """
+
+        run = np.load(run_path, mmap_mode='r')
+        for block_beg in range(0, len(run), block_rows):
+            block = run[block_beg:block_beg+block_rows]
+            yield from zip(block["pag"].tolist(), block["pck"].tolist(), block["row"].tolist(), block["ori"].tolist())
+
+    def __stream_save_json(self, merged_records):
+        """
+            given records merged in order of PAG id, package id and row, filter and
+            write bank PAG by PAG, same as json.dump(..., sort_keys=True, indent=4)
+        """
 
         filename = str(self.mat_name)
         output_path = os.path.join(self.dir_path, filename)
+        pag_num = 0
         with open(output_path, 'w') as output:
-            json.dump(self.info_dict, output, sort_keys=True, indent=4)
+            for (pag_id, pag_records) in itertools.groupby(merged_records, key=lambda record: record[0]):
+                # orientations of each package in current PAG
+                pck_list = [(pck_id, [record[3] for record in pck_records]) \
+                    for (pck_id, pck_records) in itertools.groupby(pag_records, key=lambda record: record[1])]
+                # delete PAG with one single package, and package with one single grain
+                if len(pck_list) <= 1:
+                    continue
+                pck_blocks = [("PCK_" + pck_id.decode('utf-8'), _grain_json_strs(ori_list)) \
+                    for (pck_id, ori_list) in pck_list if len(ori_list) > 1]
+                output.write(("{\n" if pag_num == 0 else ",\n") + \
+                    _pag_json_block("PAG_" + pag_id.decode('utf-8'), pck_blocks))
+                pag_num = pag_num + 1
+            output.write("\n}" if pag_num != 0 else "{}")
 
 if __name__ == "__main__":
 
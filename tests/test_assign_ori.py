@@ -0,0 +1,33 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+from assign_ori import AssignOriToRve
+
+linear_sum_assignment = pytest.importorskip("scipy.optimize").linear_sum_assignment
+
+
+def test_optimal_assignment_matches_linear_sum_assignment(tmp_path):
+    rng = random.Random(0)
+    grain = {"phi": 1.0, "phi1": 2.0, "phi2": 3.0}
+    for case in range(100):
+        rve_num = rng.randint(2, 12)
+        bank_sizes = {"PAG_{}".format(pag): sorted((rng.randint(1, 6) for pck in range(rng.randint(4, 5))), \
+            reverse=True) for pag in range(rng.randint(rve_num, rve_num + 10))}
+        hierarch_dict = {str(pag): [rng.randint(1, 6) for pck in range(rng.randint(1, 4))] for pag in range(rve_num)}
+        json_path = str(tmp_path / "bank_{}.json".format(case))
+        with open(json_path, 'w') as json_file:
+            json.dump({pag_name: {"{}_PCK_{}".format(pag_name, pck): [grain] * size \
+                for (pck, size) in enumerate(sizes)} for (pag_name, sizes) in bank_sizes.items()}, json_file)
+        # match degree of every RVE PAG against every bank PAG
+        degrees = np.array([[sum(sizes[:len(pck_list)]) - sum(pck_list) for sizes in bank_sizes.values()] \
+            for pck_list in hierarch_dict.values()])
+        (rows, cols) = linear_sum_assignment(degrees, maximize=True)
+
+        assign = AssignOriToRve(json_path, hierarch_dict, assignment="optimal", seed=case)
+        mat_pags = [relation[1][0] for relation in assign.match_relationship]
+        assert len(set(mat_pags)) == rve_num
+        assert sum(relation[1][1] for relation in assign.match_relationship) == degrees[rows, cols].sum()
+        assert not np.isnan(assign.assigned_ori).any()
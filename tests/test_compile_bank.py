@@ -0,0 +1,39 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from compile_bank import CompiledMatBank
+
+
+def test_concurrent_compile_of_fresh_cache(tmp_path):
+    grain = {"phi": 1.0, "phi1": 2.0, "phi2": 3.0}
+    bank = {"PAG_{}".format(pag): {"PCK_{}".format(pck): [grain] * (pck + 2) for pck in range(3)} for pag in range(50)}
+    json_path = str(tmp_path / "bank.json")
+    with open(json_path, 'w') as json_file:
+        json.dump(bank, json_file)
+
+    def load(_):
+        mat_bank = CompiledMatBank(json_path)
+        return (len(mat_bank.pag_names), int(mat_bank.pck_sizes.sum()))
+
+    for trial in range(5):
+        with ThreadPoolExecutor(8) as executor:
+            assert set(executor.map(load, range(8))) == {(50, 50 * 9)}
+
+
+def test_load_of_valid_cache_creates_no_lock_file(tmp_path):
+    grain = {"phi": 1.0, "phi1": 2.0, "phi2": 3.0}
+    json_path = str(tmp_path / "bank.json")
+    with open(json_path, 'w') as json_file:
+        json.dump({"PAG_0": {"PCK_0": [grain] * 2}}, json_file)
+    CompiledMatBank(json_path)
+    os.remove(json_path + ".cache.lock")
+    # a read-only bank location cannot hold a new lock file
+    assert len(CompiledMatBank(json_path).pag_names) == 1
+    assert not os.path.exists(json_path + ".cache.lock")
+    # no lock file is left beside a missing bank
+    with pytest.raises(FileNotFoundError):
+        CompiledMatBank(str(tmp_path / "missing.json"))
+    assert sorted(os.listdir(tmp_path)) == ["bank.json", "bank.json.cache"]
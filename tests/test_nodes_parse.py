@@ -0,0 +1,72 @@
+import numpy as np
+
+from nodes_parse import NodesParse
+
+
+def mesh_write(inp_path, comment_lines=""):
+    """ write a cube of 3 x 3 x 3 nodes and 8 elements with face node sets and grain element sets """
+
+    node_lines = []
+    labels = {}
+    for (ind, (z, y, x)) in enumerate(np.ndindex(3, 3, 3)):
+        labels[(x, y, z)] = ind + 1
+        node_lines.append("{}, {}, {}, {}".format(ind + 1, 0.5 * x, 0.5 * y, 0.5 * z))
+    elem_lines = []
+    for (ind, (z, y, x)) in enumerate(np.ndindex(2, 2, 2)):
+        corners = [labels[(x + dx, y + dy, z + dz)] for (dz, dy, dx) in np.ndindex(2, 2, 2)]
+        elem_lines.append(", ".join(map(str, [ind + 1] + corners)))
+    face_lines = []
+    for (axis_ind, axis) in enumerate("xyz"):
+        for (side, value) in (('0', 0), ('1', 2)):
+            face = [label for (pos, label) in labels.items() if pos[axis_ind] == value]
+            face_lines.append("*Nset, nset={}{}\n{}".format(axis, side, ", ".join(map(str, face))))
+    with open(inp_path, 'w') as inp_file:
+        inp_file.write("*Part, name=TESS\n*Node\n" + "\n".join(node_lines) + "\n" + comment_lines + \
+            "*Element, type=C3D8\n" + "\n".join(elem_lines) + "\n" + "\n".join(face_lines) + "\n" + \
+                "*Elset, elset=poly1\n1, 2, 3, 4\n*Elset, elset=poly2\n5, 6, 7, 8\n" + \
+                    "*Elset, elset=grains\npoly1, poly2\n*End Part\n")
+
+
+def test_named_set_members_are_expanded(tmp_path):
+    inp_path = str(tmp_path / "cube.inp")
+    mesh_write(inp_path)
+    nodes = NodesParse(inp_path)
+    assert sorted(nodes.elsets["grains"].tolist()) == list(range(1, 9))
+    assert len(nodes.node_labels) == 27
+    # interior face nodes, edges and vertices are removed from faces
+    assert all(len(nodes.faces[face]) == 1 for face in nodes.faces)
+
+
+def test_comments_after_parallel_node_block(tmp_path, monkeypatch):
+    inp_path = str(tmp_path / "cube.inp")
+    mesh_write(inp_path, comment_lines="** end of nodes\n**\n")
+    serial = NodesParse(inp_path, workers=1)
+    monkeypatch.setattr("nodes_parse.PARALLEL_MIN_BYTES", 0)
+    parallel = NodesParse(inp_path, workers=2)
+    assert np.array_equal(serial.node_labels, parallel.node_labels)
+    assert np.array_equal(serial.node_coords, parallel.node_coords)
+
+
+def test_periodic_pair_across_rounding_boundary(tmp_path):
+    # y sits on a rounding boundary of the tolerance of box [0, 2], and is perturbed
+    # far below tolerance to opposite sides in faces x1 and x0
+    abs_tol = 2e-6
+    y = 500000.5 * abs_tol
+    corners = [(x, y_c, z) for z in (0, 2) for y_c in (0, 2) for x in (0, 2)]
+    face_nodes = [(2, y - 1e-13, 0.5), (2, y + 1e-13, 1.5), (0, y + 1e-13, 0.5), (0, y - 1e-13, 1.5)]
+    coords = corners + face_nodes
+    node_lines = ["{}, {!r}, {!r}, {!r}".format(ind + 1, *coord) for (ind, coord) in enumerate(coords)]
+    face_lines = []
+    for (axis_ind, axis) in enumerate("xyz"):
+        for (side, value) in (('0', 0), ('1', 2)):
+            face = [ind + 1 for (ind, coord) in enumerate(coords) if coord[axis_ind] == value]
+            face_lines.append("*Nset, nset={}{}\n{}".format(axis, side, ", ".join(map(str, face))))
+    inp_path = str(tmp_path / "straddle.inp")
+    with open(inp_path, 'w') as inp_file:
+        inp_file.write("*Part, name=TESS\n*Node\n" + "\n".join(node_lines) + "\n" + \
+            "\n".join(face_lines) + "\n*End Part\n")
+    nodes = NodesParse(inp_path)
+    partner = nodes.periodic_pair("x1", "x0")
+    assert partner is not None
+    assert np.allclose(nodes.node_coords[nodes.faces["x1"]][:, 1:], nodes.node_coords[partner][:, 1:])
+    assert nodes.row_to_label(partner).tolist() == [11, 12]